@@ -0,0 +1,160 @@
+"""
+FINAURA Amount Normalizer
+-------------------------
+
+Install (once):
+    pip install pandas numpy
+
+Benchmark (example):
+    python finaura_amounts.py --bench 3000000
+    python finaura_amounts.py --check          # Alt-vs-neu-Tabelle prüfen
+
+Converts raw amount strings from IK extracts into floats in one vectorized
+pass (pandas string ops instead of one Python call per regex match).
+
+Handled formats (Swiss + common variants):
+- 1'234.50   1’234.50   1 234,50   1.234,50   1,234.50
+- 1'234.–    1'234.-    CHF 1'234   -1'234.50
+Rule: the last separator is the decimal mark only if it is followed by
+1–2 digits; every other separator (' ’ . , space) is a thousands mark.
+Unparseable input yields NaN (vectorized) / None (scalar).
+
+This replaces the per-analyzer helpers (v1.1.0 `_norm_amount`, v1.2.2
+`_clean_amount`), which disagreed with each other and with the rule above
+for several inputs – so some IK totals change. `LEGACY_CASES` lists those
+cases old vs. new; `--check` verifies the current results against it.
+"""
+
+from __future__ import annotations
+import re
+import time
+from typing import Iterable, Optional
+
+import numpy as np
+import pandas as pd
+
+_STRIP_RE    = r"CHF|Fr\.|[\s_'’]"
+_DASH_END_RE = r"[.,]?[-–—]+$"
+_PARTS_RE    = r"^(?P<sign>-?)(?P<int>\d[\d.,]*?)(?:[.,](?P<frac>\d{1,2}))?$"
+
+def normalize_amounts(raw: Iterable[str] | pd.Series) -> np.ndarray:
+    """Vectorized: return a float64 array (NaN where no amount was found).
+
+    IK-Auszüge wiederholen dieselben Beträge oft; darum wird nur jeder
+    eindeutige Rohwert einmal normalisiert und danach zurückverteilt.
+    """
+    s = raw if isinstance(raw, pd.Series) else pd.Series(list(raw), dtype="object")
+    if s.empty:
+        return np.empty(0, dtype="float64")
+    codes, uniques = pd.factorize(s.fillna(""))
+    u = pd.Series(uniques, dtype="object").astype(str)
+    u = u.str.replace(_STRIP_RE, "", regex=True, flags=re.IGNORECASE)
+    u = u.str.replace(_DASH_END_RE, "", regex=True).str.rstrip(".,")
+    parts = u.str.extract(_PARTS_RE)
+    digits = parts["int"].str.replace(r"[.,]", "", regex=True)
+    num = parts["sign"] + digits + "." + parts["frac"].fillna("0")
+    vals = pd.to_numeric(num, errors="coerce").astype("float64")
+    # Fallback (wie bisher): alles ausser Ziffern verwerfen, Vorzeichen behalten
+    miss = vals.isna()
+    if miss.any():
+        rest = u[miss]
+        sign = rest.str.startswith("-").map({True: "-", False: ""})
+        vals.loc[miss] = pd.to_numeric(sign + rest.str.replace(r"\D", "", regex=True), errors="coerce")
+    return vals.to_numpy(dtype="float64")[codes]
+
+def normalize_amount(raw: str) -> Optional[float]:
+    """Scalar convenience wrapper around normalize_amounts()."""
+    v = normalize_amounts([raw])[0]
+    return None if np.isnan(v) else float(v)
+
+def _normalize_amount_scalar(raw: str) -> Optional[float]:
+    """Reference implementation (one call per match) – used as benchmark baseline."""
+    s = re.sub(_STRIP_RE, "", raw or "", flags=re.IGNORECASE)
+    s = re.sub(_DASH_END_RE, "", s).rstrip(".,")
+    m = re.match(_PARTS_RE, s)
+    try:
+        if m:
+            digits = re.sub(r"[.,]", "", m.group("int"))
+            return float(f"{m.group('sign')}{digits}.{m.group('frac') or '0'}")
+        return float(int(("-" if s.startswith("-") else "") + re.sub(r"\D", "", s)))
+    except Exception:
+        return None
+
+# Eingaben, bei denen sich das Ergebnis gegenüber den alten Analyzer-Helfern ändert:
+# (roh, v1.1.0 _norm_amount, v1.2.2 _clean_amount, jetzt)
+LEGACY_CASES = [
+    ("1'234.50",  123450.0,  None,   1234.5),
+    ("-1'234.50", -123450.0, None,   -1234.5),
+    ("1,234.50",  1.2345,    None,   1234.5),
+    ("1.234,50",  1234.5,    None,   1234.5),
+    ("0.05",      5.0,       0.05,   0.05),
+    ("12.5",      125.0,     12.5,   12.5),
+    ("12,345",    12.345,    12.345, 12345.0),
+    ("1.234",     1234.0,    1.234,  1234.0),
+    ("1'234.–",   1234.0,    None,   1234.0),
+    ("CHF 85'300", 85300.0,  None,   85300.0),
+    ("-12a34",    -12.0,     None,   -1234.0),
+]
+
+def check_legacy_cases() -> list:
+    """Liefert [(roh, erwartet, erhalten)] für Abweichungen von LEGACY_CASES (leer = OK),
+    vektorisiert und skalar."""
+    bad = []
+    vec = normalize_amounts([c[0] for c in LEGACY_CASES])
+    for (raw, _, _, want), v in zip(LEGACY_CASES, vec):
+        for got in (float(v), _normalize_amount_scalar(raw)):
+            if got != want:
+                bad.append((raw, want, got))
+    return bad
+
+# ----------------- Benchmark -----------------
+_BENCH_SAMPLES = ["1'234.50", "1’234.–", "1 234,50", "CHF 85'300", "12.5", "1.234.567,80", "-2'000.-", "n/a"]
+
+def _synthetic_tokens(n: int, distinct: int, seed: int = 7) -> list:
+    rng = np.random.default_rng(seed)
+    cents = rng.integers(0, 25_000_000, size=distinct)
+    fmts = [
+        lambda c: f"{c // 100:,}.{c % 100:02d}".replace(",", "'"),
+        lambda c: f"{c // 100:,}.–".replace(",", "’"),
+        lambda c: f"{c // 100:,},{c % 100:02d}".replace(",", " ", f"{c // 100:,}".count(",")),
+        lambda c: f"CHF {c // 100:,}".replace(",", "'"),
+    ]
+    pool = [fmts[i % len(fmts)](int(c)) for i, c in enumerate(cents)] + _BENCH_SAMPLES
+    return [pool[i] for i in rng.integers(0, len(pool), size=n)]
+
+def _bench(n: int = 3_000_000, distinct: Optional[int] = None) -> None:
+    distinct = distinct or max(n // 20, 1)
+    tokens = _synthetic_tokens(n, distinct)
+    t0 = time.perf_counter()
+    ref = [_normalize_amount_scalar(x) for x in tokens]
+    t1 = time.perf_counter()
+    vec = normalize_amounts(tokens)
+    t2 = time.perf_counter()
+    ref_arr = np.array([np.nan if v is None else v for v in ref], dtype="float64")
+    same = bool(np.array_equal(ref_arr, vec, equal_nan=True))
+    print(f"tokens:     {n:,} ({distinct:,} verschiedene)".replace(",", "'"))
+    print(f"scalar:     {t1 - t0:8.3f} s")
+    print(f"vectorized: {t2 - t1:8.3f} s  (x{(t1 - t0) / max(t2 - t1, 1e-9):.1f})")
+    print(f"identisch:  {same}")
+
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="FINAURA Amount Normalizer")
+    ap.add_argument("--bench", type=int, nargs="?", const=3_000_000, help="Anzahl Tokens für Benchmark")
+    ap.add_argument("--distinct", type=int, default=None, help="Anzahl verschiedener Beträge (Default: Tokens/20)")
+    ap.add_argument("--check", action="store_true", help="Ergebnisse gegen LEGACY_CASES prüfen")
+    args = ap.parse_args()
+    if args.check:
+        print(f"{'roh':>12} {'v1.1.0':>10} {'v1.2.2':>8} {'jetzt':>9}")
+        for raw, old_norm, old_clean, new in LEGACY_CASES:
+            print(f"{raw:>12} {old_norm!s:>10} {old_clean!s:>8} {new!s:>9}")
+        bad = check_legacy_cases()
+        for raw, want, got in bad:
+            print(f"ABWEICHUNG {raw!r}: erwartet {want}, erhalten {got}")
+        print("OK" if not bad else f"{len(bad)} Abweichung(en)")
+        raise SystemExit(1 if bad else 0)
+    if args.bench:
+        _bench(args.bench, args.distinct)
+    else:
+        for x in _BENCH_SAMPLES:
+            print(f"{x!r:>16} -> {normalize_amount(x)}")
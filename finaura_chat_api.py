@@ -0,0 +1,354 @@
+"""
+FINAURA Chat – HTTP/JSON API
+----------------------------
+
+Install (once):
+    nothing beyond the standard library (uses finaura_chat_async)
+
+Run (example):
+    python finaura_chat_api.py --host 127.0.0.1 --port 8765
+
+Headless HTTP/1.1 service over the chat schema, independent of the
+Streamlit script. Runs on one asyncio event loop via AsyncChatDB;
+connections stay open (keep-alive) until the client closes them or
+FINAURA_API_IDLE_S passes without a request.
+
+Routes (JSON in/out):
+    GET  /health
+    GET  /planners/online?k=10
+    POST /planners/{id}/heartbeat
+    POST /customers                       {"anon_id"}
+    POST /threads                         {"customer_id", "planner_handle"?}
+    GET  /threads?role=customer|planner&user_id=1
+    GET  /threads/{id}
+    GET  /threads/{id}/messages?after=0&wait=25      (incremental, optional long-poll)
+    GET  /threads/{id}/messages?before=120&limit=50  (keyset page, newest first without before)
+    POST /threads/{id}/messages           {"sender", "content"} → {"id"}
+    POST /threads/{id}/payment            {"paid"}
+    POST /threads/{id}/release            {"released"}
+    POST /threads/{id}/status             {"status"}
+    POST /threads/{id}/rating             {"rating", "feedback"?}
+    GET  /search?q=säule&planner_id=1&page=0
+
+Unknown thread, customer, planner ids and handles answer 404; planner
+messages on unpaid tickets 409 (same gate as the chat UI). Fields of the
+wrong JSON type answer 400.
+
+No authentication: bind to localhost (default) or put it behind a proxy
+that authenticates. CORS origin for the landing page:
+    FINAURA_API_CORS (default: none)
+"""
+
+from __future__ import annotations
+import asyncio
+import json
+import os
+import re
+import sqlite3
+from typing import Optional
+from urllib.parse import parse_qs, urlsplit
+
+import finaura_chat_db as chat_db
+from finaura_chat_async import AsyncChatDB
+
+IDLE_TIMEOUT_S = float(os.getenv("FINAURA_API_IDLE_S", "15"))
+MAX_BODY_BYTES = 64 * 1024
+MAX_HEADER_BYTES = 16 * 1024
+MAX_WAIT_S = 30.0
+CORS_ORIGIN = os.getenv("FINAURA_API_CORS", "")
+
+_REASONS = {200: "OK", 201: "Created", 204: "No Content", 400: "Bad Request", 404: "Not Found",
+            405: "Method Not Allowed", 409: "Conflict", 413: "Payload Too Large", 500: "Internal Server Error"}
+
+class ApiError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+def _jsonable(value):
+    if isinstance(value, sqlite3.Row):
+        return dict(value)
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(v) for v in value]
+    if isinstance(value, dict):
+        return {k: _jsonable(v) for k, v in value.items()}
+    return value
+
+def _int(params: dict, name: str, default: Optional[int] = None, required: bool = False) -> Optional[int]:
+    raw = params.get(name)
+    if raw is None or raw == "":
+        if required:
+            raise ApiError(400, f"'{name}' fehlt")
+        return default
+    try:
+        return int(raw)
+    except (TypeError, ValueError):
+        raise ApiError(400, f"'{name}' muss eine Zahl sein")
+
+def _require(body: dict, name: str):
+    if name not in body:
+        raise ApiError(400, f"'{name}' fehlt")
+    return body[name]
+
+def _str(body: dict, name: str, default: Optional[str] = None, required: bool = True) -> Optional[str]:
+    value = _require(body, name) if required else body.get(name, default)
+    if value is None and not required:
+        return default
+    if not isinstance(value, str):
+        raise ApiError(400, f"'{name}' muss ein String sein")
+    return value
+
+def _flag(body: dict, name: str) -> int:
+    value = _require(body, name)
+    if value not in (True, False, 0, 1):  # 0/1 wie in der DB, keine Listen/Strings
+        raise ApiError(400, f"'{name}' muss true/false sein")
+    return int(value)
+
+async def _thread(db, m) -> dict:
+    state = await db.get_thread_summary(int(m["id"]))
+    if state is None:
+        raise ApiError(404, "Thread nicht gefunden")
+    return state
+
+# ---------- Handler: (db, match, params, body) -> (status, payload) ----------
+async def _health(db, m, params, body):
+    return 200, {"status": "ok", "schema": chat_db.SCHEMA_VERSION, "pool": db.pool.stats()}
+
+async def _online(db, m, params, body):
+    return 200, db.list_online_planners(_int(params, "k"))
+
+async def _heartbeat(db, m, params, body):
+    if not await db.planner_heartbeat(int(m["id"])):
+        raise ApiError(404, "Berater:in nicht gefunden")
+    return 204, None
+
+async def _create_customer(db, m, params, body):
+    return 201, {"id": await db.ensure_customer(_str(body, "anon_id"))}
+
+async def _create_thread(db, m, params, body):
+    customer_id = _int(body, "customer_id", required=True)
+    handle = _str(body, "planner_handle", "", required=False).strip()
+    if not await db.customer_exists(customer_id):
+        raise ApiError(404, "Kunde nicht gefunden")
+    if handle and await db.get_planner_by_handle(handle) is None:
+        raise ApiError(404, "Berater:in nicht gefunden")
+    planner_id = await db.pick_planner(handle)
+    if planner_id is None:
+        raise ApiError(409, "Keine Berater:innen registriert")
+    thread_id = await db.create_thread(customer_id, planner_id)
+    return 201, {"id": thread_id, "planner_id": planner_id}
+
+async def _list_threads(db, m, params, body):
+    role = params.get("role", "customer")
+    if role not in ("customer", "planner"):
+        raise ApiError(400, "role muss 'customer' oder 'planner' sein")
+    return 200, await db.get_user_threads(role, _int(params, "user_id", required=True))
+
+async def _thread_state(db, m, params, body):
+    return 200, await _thread(db, m)
+
+async def _messages(db, m, params, body):
+    thread_id = (await _thread(db, m))["id"]
+    after = _int(params, "after")
+    if after is not None:
+        try:
+            wait = min(float(params.get("wait") or 0), MAX_WAIT_S)
+        except ValueError:
+            raise ApiError(400, "'wait' muss eine Zahl sein")
+        seen = chat_db.CHANGES.version(thread_id)  # vor der Abfrage lesen: kein verpasstes publish()
+        rows = await db.get_messages_after(thread_id, after)
+        if not rows and wait > 0:
+            # Long-Poll: auf den Änderungs-Feed warten statt den Client pollen zu lassen
+            await db.wait_for_change(thread_id, seen, wait)
+            rows = await db.get_messages_after(thread_id, after)
+        last = rows[-1]["id"] if rows else after
+        return 200, {"messages": rows, "next_after": last}
+    limit = max(1, min(_int(params, "limit", chat_db.MESSAGE_PAGE_SIZE), 200))
+    rows = await db.get_messages_before(thread_id, _int(params, "before"), limit + 1)
+    has_older = len(rows) > limit
+    rows = rows[-limit:]
+    return 200, {"messages": rows, "next_before": rows[0]["id"] if rows and has_older else None}
+
+async def _post_message(db, m, params, body):
+    sender = _str(body, "sender")
+    if sender not in ("customer", "planner"):
+        raise ApiError(400, "sender muss 'customer' oder 'planner' sein")
+    content = _str(body, "content").strip()
+    if not content:
+        raise ApiError(400, "content ist leer")
+    state = await _thread(db, m)
+    if sender == "planner" and not state["paid"]:
+        raise ApiError(409, "Ticket ist nicht bezahlt – Antwort erst nach Zahlung")
+    mid = await db.add_message(state["id"], sender, content)
+    return 201, {"id": mid}
+
+async def _payment(db, m, params, body):
+    await _thread(db, m)
+    await db.set_thread_paid(int(m["id"]), _flag(body, "paid"))
+    return 200, await db.get_thread_state(int(m["id"]))
+
+async def _release(db, m, params, body):
+    await _thread(db, m)
+    await db.set_thread_released(int(m["id"]), _flag(body, "released"))
+    return 200, await db.get_thread_state(int(m["id"]))
+
+async def _status(db, m, params, body):
+    status = _str(body, "status")
+    if status not in ("open", "closed"):
+        raise ApiError(400, "status muss 'open' oder 'closed' sein")
+    await _thread(db, m)
+    await db.set_thread_status(int(m["id"]), status)
+    return 200, await db.get_thread_state(int(m["id"]))
+
+async def _rating(db, m, params, body):
+    rating = _int(body, "rating", required=True)
+    if not 1 <= rating <= 5:
+        raise ApiError(400, "rating muss 1..5 sein")
+    await _thread(db, m)
+    result = await db.rate_thread(int(m["id"]), rating, _str(body, "feedback", "", required=False))
+    if result is None:
+        await _thread(db, m)  # inzwischen archiviert → 404
+        raise ApiError(409, "Thread ist bereits bewertet")
+    return 200, result
+
+async def _search(db, m, params, body):
+    return 200, await db.search_messages(params.get("q", ""), _int(params, "planner_id"), _int(params, "page", 0))
+
+ROUTES = [
+    ("GET",  r"/health", _health),
+    ("GET",  r"/planners/online", _online),
+    ("POST", r"/planners/(?P<id>\d+)/heartbeat", _heartbeat),
+    ("POST", r"/customers", _create_customer),
+    ("POST", r"/threads", _create_thread),
+    ("GET",  r"/threads", _list_threads),
+    ("GET",  r"/threads/(?P<id>\d+)", _thread_state),
+    ("GET",  r"/threads/(?P<id>\d+)/messages", _messages),
+    ("POST", r"/threads/(?P<id>\d+)/messages", _post_message),
+    ("POST", r"/threads/(?P<id>\d+)/payment", _payment),
+    ("POST", r"/threads/(?P<id>\d+)/release", _release),
+    ("POST", r"/threads/(?P<id>\d+)/status", _status),
+    ("POST", r"/threads/(?P<id>\d+)/rating", _rating),
+    ("GET",  r"/search", _search),
+]
+_COMPILED = [(method, re.compile(pattern + r"/?$"), fn) for method, pattern, fn in ROUTES]
+
+async def dispatch(db: AsyncChatDB, method: str, target: str, body: bytes) -> tuple:
+    """Eine Anfrage ausführen; liefert (status, payload). Auch ohne Socket nutzbar (Tests, Lasttest)."""
+    url = urlsplit(target)
+    params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+    allowed = False
+    for route_method, pattern, fn in _COMPILED:
+        m = pattern.match(url.path)
+        if not m:
+            continue
+        allowed = True
+        if route_method != method:
+            continue
+        try:
+            data = json.loads(body) if body else {}
+            if not isinstance(data, dict):
+                raise ApiError(400, "JSON-Objekt erwartet")
+            return await fn(db, m, params, data)
+        except ApiError as e:
+            return e.status, {"error": str(e)}
+        except json.JSONDecodeError:
+            return 400, {"error": "Ungültiges JSON"}
+        except sqlite3.IntegrityError as e:
+            return 409, {"error": str(e)}
+    return (405, {"error": "Methode nicht erlaubt"}) if allowed else (404, {"error": "Nicht gefunden"})
+
+def _response(status: int, payload, keep_alive: bool) -> bytes:
+    body = b"" if payload is None and status == 204 else json.dumps(
+        _jsonable(payload), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    headers = [
+        f"HTTP/1.1 {status} {_REASONS.get(status, 'OK')}",
+        "Content-Type: application/json; charset=utf-8",
+        f"Content-Length: {len(body)}",
+        f"Connection: {'keep-alive' if keep_alive else 'close'}",
+    ]
+    if keep_alive:
+        headers.append(f"Keep-Alive: timeout={int(IDLE_TIMEOUT_S)}")
+    if CORS_ORIGIN:
+        headers += [f"Access-Control-Allow-Origin: {CORS_ORIGIN}",
+                    "Access-Control-Allow-Methods: GET, POST, OPTIONS",
+                    "Access-Control-Allow-Headers: Content-Type"]
+    return ("\r\n".join(headers) + "\r\n\r\n").encode("latin-1") + body
+
+class ChatApiServer:
+    """HTTP/1.1-Server mit Keep-Alive über asyncio-Streams (ohne Framework)."""
+
+    def __init__(self, db: AsyncChatDB):
+        self.db = db
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), IDLE_TIMEOUT_S)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    return
+                except asyncio.LimitOverrunError:
+                    writer.write(_response(413, {"error": "Header zu gross"}, False))
+                    return
+                lines = head.decode("latin-1").split("\r\n")
+                try:
+                    method, target, version = lines[0].split(" ", 2)
+                except ValueError:
+                    writer.write(_response(400, {"error": "Ungültige Anfragezeile"}, False))
+                    return
+                headers = {}
+                for line in lines[1:]:
+                    if ":" in line:
+                        k, v = line.split(":", 1)
+                        headers[k.strip().lower()] = v.strip()
+                conn_hdr = headers.get("connection", "").lower()
+                keep_alive = conn_hdr != "close" if version == "HTTP/1.1" else conn_hdr == "keep-alive"
+                try:
+                    length = int(headers.get("content-length") or 0)
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    writer.write(_response(400, {"error": "Ungültige Content-Length"}, False))
+                    return
+                if length > MAX_BODY_BYTES:
+                    writer.write(_response(413, {"error": "Body zu gross"}, False))
+                    return
+                try:
+                    body = await reader.readexactly(length) if length else b""
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    return  # Client hat weniger als Content-Length gesendet und geschlossen
+                if method == "OPTIONS":
+                    status, payload = 204, None
+                else:
+                    try:
+                        status, payload = await dispatch(self.db, method, target, body)
+                    except Exception as e:  # Verbindung offen halten, Fehler melden
+                        status, payload = 500, {"error": type(e).__name__}
+                writer.write(_response(status, payload, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    return
+        finally:
+            writer.close()
+
+    async def serve(self, host: str, port: int) -> None:
+        server = await asyncio.start_server(self.handle, host, port, limit=MAX_HEADER_BYTES)
+        async with server:
+            await server.serve_forever()
+
+async def main(host: str, port: int, path: Optional[str] = None) -> None:
+    async with AsyncChatDB(path) as db:
+        print(f"FINAURA Chat API auf http://{host}:{port}")
+        await ChatApiServer(db).serve(host, port)
+
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="FINAURA Chat – HTTP/JSON API")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--db", default=None, help="SQLite-Pfad (Default: FINAURA_DB_PATH)")
+    args = ap.parse_args()
+    try:
+        asyncio.run(main(args.host, args.port, args.db))
+    except KeyboardInterrupt:
+        pass
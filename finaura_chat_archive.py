@@ -0,0 +1,252 @@
+"""
+FINAURA Chat – Archiv (Hot/Cold)
+--------------------------------
+
+Install (once):
+    nothing beyond the standard library (uses finaura_chat_db)
+
+Run (example):
+    python finaura_chat_archive.py --once                 # ein kompletter Durchlauf
+    python finaura_chat_archive.py --once --days 0 --vacuum
+
+Moves closed and released threads (with messages and ratings) out of the
+live chat DB into monthly archive databases (chat_archive_YYYY_MM.db,
+month of thread creation). The live DB keeps a small directory table
+(archived_threads) so archived tickets stay listable; their messages are
+read from the archive file through a read-only connection on demand.
+
+Runs incrementally in small batches on a background thread
+(`start_archiver()`). Each batch first commits the copy into the archive
+(synchronous=FULL), then deletes from live in a second transaction; the
+copy is INSERT OR IGNORE, so an interrupted run simply repeats.
+Archived messages leave the full-text index (messages_fts) with them.
+
+Settings:
+    FINAURA_ARCHIVE_DIR      (default: chat_archive/ next to the DB)
+    FINAURA_ARCHIVE_DAYS     (default: 30 – Tage seit der letzten Nachricht)
+    FINAURA_ARCHIVE_EVERY_S  (default: 900)
+"""
+
+from __future__ import annotations
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+import finaura_chat_db as chat_db
+
+ARCHIVE_DAYS = float(os.getenv("FINAURA_ARCHIVE_DAYS", "30"))
+ARCHIVE_EVERY_S = float(os.getenv("FINAURA_ARCHIVE_EVERY_S", "900"))
+ARCHIVE_BATCH = 200          # Threads pro Transaktion (kurze Schreibsperren)
+ARCHIVE_PAUSE_S = 0.05       # Pause zwischen Batches, damit Chat-Schreiber drankommen
+
+_ARCHIVE_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS {a}.threads (
+        id INTEGER PRIMARY KEY, customer_id INTEGER, planner_id INTEGER,
+        status TEXT, created_at TEXT, paid INTEGER, released INTEGER
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS {a}.messages (
+        id INTEGER PRIMARY KEY, thread_id INTEGER, sender TEXT, content TEXT, ts TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS {a}.ratings (
+        id INTEGER PRIMARY KEY, thread_id INTEGER UNIQUE, score INTEGER, feedback TEXT, created_at TEXT
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS {a}.idx_messages_thread ON messages(thread_id, id)",
+]
+
+def archive_dir(db_path: Optional[str] = None) -> str:
+    default = os.path.join(os.path.dirname(os.path.abspath(db_path or chat_db.DB_PATH)), "chat_archive")
+    return os.getenv("FINAURA_ARCHIVE_DIR", default)
+
+def archive_name(created_at: Optional[str]) -> str:
+    """Archiv-Datei nach Erstellungsmonat des Threads (stabil, unabhängig vom Archivierungszeitpunkt)."""
+    ym = (created_at or "")[:7]
+    if len(ym) == 7 and ym[4] == "-":
+        return f"chat_archive_{ym.replace('-', '_')}.db"
+    return "chat_archive_undatiert.db"
+
+def archive_batch(conn, db_path: Optional[str] = None, days: float = ARCHIVE_DAYS,
+                  limit: int = ARCHIVE_BATCH) -> int:
+    """Verschiebt bis zu `limit` archivierbare Threads; liefert die Anzahl."""
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=days)).isoformat()
+    rows = conn.execute(chat_db.SQL_ARCHIVE_CANDIDATES, (cutoff, limit)).fetchall()
+    if conn.in_transaction:
+        conn.commit()
+    if not rows:
+        return 0
+    groups: dict = {}
+    for r in rows:
+        groups.setdefault(archive_name(r["created_at"]), []).append(r)
+    folder = archive_dir(db_path)
+    os.makedirs(folder, exist_ok=True)
+    moved = 0
+    for name, group in groups.items():
+        ids = [r["id"] for r in group]
+        marks = ",".join("?" * len(ids))
+        conn.execute("ATTACH DATABASE ? AS arch", (os.path.join(folder, name),))
+        try:
+            # Mit WAL ist ein Commit über angehängte Dateien nicht atomar: zuerst das Archiv
+            # dauerhaft committen, erst danach im Live-DB löschen (Wiederholung per INSERT OR IGNORE)
+            conn.execute("PRAGMA arch.synchronous=FULL")
+            for stmt in _ARCHIVE_SCHEMA:
+                conn.execute(stmt.format(a="arch"))
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Thread-Zeile ersetzen: nach einem übersprungenen Lauf gilt der aktuelle Stand
+                conn.execute(f"INSERT OR REPLACE INTO arch.threads(id, customer_id, planner_id, status, created_at, paid, released) "
+                             f"SELECT id, customer_id, planner_id, status, created_at, paid, released "
+                             f"FROM main.threads WHERE id IN ({marks})", ids)
+                conn.execute(f"INSERT OR IGNORE INTO arch.messages(id, thread_id, sender, content, ts) "
+                             f"SELECT id, thread_id, sender, content, ts FROM main.messages WHERE thread_id IN ({marks})", ids)
+                conn.execute(f"INSERT OR IGNORE INTO arch.ratings(id, thread_id, score, feedback, created_at) "
+                             f"SELECT id, thread_id, score, feedback, created_at FROM main.ratings WHERE thread_id IN ({marks})", ids)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Zwischen den Transaktionen wieder geöffnet/freigegeben oder Neues (Nachricht,
+                # Bewertung)? Dann bleibt der Thread live und kommt im nächsten Lauf erneut dran
+                still = {r[0] for r in conn.execute(
+                    f"SELECT id FROM main.threads WHERE id IN ({marks}) AND status = 'closed' AND released = 1", ids)}
+                late = {r[0] for r in conn.execute(
+                    f"SELECT thread_id FROM main.messages WHERE thread_id IN ({marks}) "
+                    f"AND id NOT IN (SELECT id FROM arch.messages) "
+                    f"UNION SELECT thread_id FROM main.ratings WHERE thread_id IN ({marks}) "
+                    f"AND id NOT IN (SELECT id FROM arch.ratings)", ids + ids)}
+                group = [r for r in group if r["id"] in still and r["id"] not in late]
+                ids = [r["id"] for r in group]
+                marks = ",".join("?" * len(ids))
+                now = chat_db.now_iso()
+                conn.executemany("INSERT OR REPLACE INTO archived_threads"
+                                 "(thread_id, customer_id, planner_id, status, created_at, archive, archived_at) "
+                                 "VALUES (?,?,?,?,?,?,?)",
+                                 [(r["id"], r["customer_id"], r["planner_id"], r["status"], r["created_at"], name, now)
+                                  for r in group])
+                conn.execute(f"DELETE FROM main.ratings WHERE thread_id IN ({marks})", ids)
+                conn.execute(f"DELETE FROM main.messages WHERE thread_id IN ({marks})", ids)
+                conn.execute(f"DELETE FROM main.threads WHERE id IN ({marks})", ids)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        finally:
+            conn.execute("DETACH DATABASE arch")
+        moved += len(ids)
+    return moved
+
+def archive_all(pool=None, days: float = ARCHIVE_DAYS, stop: Optional[threading.Event] = None) -> int:
+    """Batches bis nichts mehr archivierbar ist (oder `stop` gesetzt wird)."""
+    pool = pool or chat_db.get_pool()
+    total = 0
+    while not (stop and stop.is_set()):
+        with pool.connection() as conn:
+            n = archive_batch(conn, pool.path, days)
+        total += n
+        if n < ARCHIVE_BATCH:
+            break
+        time.sleep(ARCHIVE_PAUSE_S)
+    return total
+
+# ---------- Lesen (read-only, bei Bedarf) ----------
+@contextmanager
+def open_archive(name: str, db_path: Optional[str] = None):
+    path = os.path.join(archive_dir(db_path), os.path.basename(name))
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    conn.row_factory = sqlite3.Row
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+def get_archived_threads(conn, role: str, user_id: int) -> list:
+    sql = chat_db.SQL_ARCHIVED_PLANNER if role == "planner" else chat_db.SQL_ARCHIVED_CUSTOMER
+    return conn.execute(sql, (user_id,)).fetchall()
+
+def get_archived_messages(conn, thread_id: int) -> list:
+    """Nachrichten eines archivierten Threads (leer, wenn der Thread nicht archiviert ist)."""
+    row = conn.execute("SELECT archive FROM archived_threads WHERE thread_id=?", (thread_id,)).fetchone()
+    if not row:
+        return []
+    main_path = next((r[2] for r in conn.execute("PRAGMA database_list") if r[1] == "main"), None)
+    with open_archive(row["archive"], main_path) as arch:
+        return [dict(r) for r in arch.execute(
+            "SELECT id, sender, content, ts FROM messages WHERE thread_id=? ORDER BY id", (thread_id,))]
+
+# ---------- Hintergrund ----------
+class Archiver(threading.Thread):
+    """Daemon-Thread: archiviert alle `every_s` Sekunden inkrementell."""
+
+    def __init__(self, pool, every_s: float = ARCHIVE_EVERY_S, days: float = ARCHIVE_DAYS):
+        super().__init__(name="finaura-archiver", daemon=True)
+        self.pool, self.every_s, self.days = pool, every_s, days
+        self.stop_event = threading.Event()
+        self.stats = {"runs": 0, "archived": 0, "errors": 0, "last_run": None}
+
+    def run(self) -> None:
+        while not self.stop_event.is_set():
+            try:
+                self.stats["archived"] += archive_all(self.pool, self.days, self.stop_event)
+            except sqlite3.Error:
+                self.stats["errors"] += 1
+            self.stats["runs"] += 1
+            self.stats["last_run"] = chat_db.now_iso()
+            self.stop_event.wait(self.every_s)
+
+    def stop(self) -> None:
+        self.stop_event.set()
+
+_ARCHIVERS: dict = {}
+_ARCHIVERS_LOCK = threading.Lock()
+
+def start_archiver(path: Optional[str] = None) -> Archiver:
+    """Einmal pro Prozess und Datenbank starten (weitere Aufrufe liefern denselben Thread)."""
+    pool = chat_db.get_pool(path)
+    with _ARCHIVERS_LOCK:
+        a = _ARCHIVERS.get(pool.path)
+        if a is None or not a.is_alive():
+            a = _ARCHIVERS[pool.path] = Archiver(pool)
+            a.start()
+        return a
+
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="FINAURA Chat – abgeschlossene Threads archivieren")
+    ap.add_argument("--db", default=None, help="SQLite-Pfad (Default: FINAURA_DB_PATH)")
+    ap.add_argument("--days", type=float, default=ARCHIVE_DAYS, help="Mindestalter der letzten Nachricht (Tage)")
+    ap.add_argument("--once", action="store_true", help="Einmal archivieren und beenden")
+    ap.add_argument("--vacuum", action="store_true", help="Live-DB danach verkleinern (VACUUM, sperrt kurz)")
+    args = ap.parse_args()
+    pool = chat_db.get_pool(args.db)
+    with pool.connection() as conn:
+        chat_db.migrate(conn)
+    size = lambda: os.path.getsize(pool.path) if os.path.exists(pool.path) else 0
+    before = size()
+    if args.once:
+        t0 = time.perf_counter()
+        n = archive_all(pool, args.days)
+        print(f"{n} Threads archiviert in {time.perf_counter() - t0:.2f} s → {archive_dir(pool.path)}")
+    else:
+        a = Archiver(pool, days=args.days)
+        a.start()
+        try:
+            while a.is_alive():
+                a.join(1.0)
+        except KeyboardInterrupt:
+            a.stop()
+    if args.vacuum:
+        with pool.connection() as conn:
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            conn.execute("VACUUM")
+    pool.close_all()
+    print(f"Live-DB: {before / 1024:.0f} KiB → {size() / 1024:.0f} KiB")
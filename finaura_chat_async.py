@@ -0,0 +1,199 @@
+"""
+FINAURA Chat – Async-Datenzugriff
+---------------------------------
+
+Install (once):
+    nothing beyond the standard library (uses finaura_chat_db)
+
+Benchmark (example):
+    python finaura_chat_async.py --sessions 200 --messages 20
+
+asyncio front end for the chat data layer, for non-Streamlit callers
+(API, load tests). Reads run on a small pool of reader threads, each with
+its own pooled connection. Writes use two writer threads:
+
+- messages and payment flags go through the process-wide group-commit
+  writer of finaura_chat_db (many sessions, one transaction); their await
+  returns after the commit;
+- all other writes (customers, threads, ratings, status, presence) run on
+  this instance's own writer thread, since those helpers commit themselves
+  and cannot join a group-commit batch.
+
+Both take SQLite's single write lock in turn (busy_timeout), so they never
+write at the same time. Callers await futures instead of holding a thread
+per session.
+
+Usage:
+    async with AsyncChatDB() as db:
+        tid = await db.create_thread(customer_id, planner_id)
+        await db.add_message(tid, "customer", "Hallo")
+        msgs = await db.get_messages_after(tid, 0)
+"""
+
+from __future__ import annotations
+import asyncio
+import functools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import finaura_chat_db as chat_db
+
+READER_THREADS = int(os.getenv("FINAURA_DB_READERS", "4"))
+
+class AsyncChatDB:
+    """Awaitable Varianten der finaura_chat_db-Helfer (gleiche Namen, ohne `conn`)."""
+
+    def __init__(self, path: Optional[str] = None, readers: int = READER_THREADS):
+        self.path = path or chat_db.DB_PATH
+        self.pool = chat_db.get_pool(self.path)
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="finaura-db-writer")
+        self._readers = ThreadPoolExecutor(max_workers=max(1, readers), thread_name_prefix="finaura-db-reader")
+        self._local = threading.local()
+        self._conns: list = []  # Pool-Verbindungen der Executor-Threads, zurück in close()
+        self._conns_lock = threading.Lock()
+
+    async def __aenter__(self) -> "AsyncChatDB":
+        await self.write(chat_db.init_db)
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._writer.shutdown(wait=True)
+        self._readers.shutdown(wait=True)
+        with self._conns_lock:
+            conns, self._conns = self._conns, []
+        for conn in conns:
+            self.pool.release(conn)
+
+    def _call(self, fn, args, kwargs):
+        # Läuft im Executor-Thread: eine Pool-Verbindung pro Thread bis close()
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self.pool.acquire()
+            with self._conns_lock:
+                self._conns.append(conn)
+        return fn(conn, *args, **kwargs)
+
+    async def read(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._readers, functools.partial(self._call, fn, args, kwargs))
+
+    async def write(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._writer, functools.partial(self._call, fn, args, kwargs))
+
+    # ---- Schreiben (eigener Writer-Thread; Nachrichten/Zahlung über den Group Commit) ----
+    async def ensure_customer(self, anon_id: str) -> int:
+        return await self.write(chat_db.ensure_customer, anon_id)
+
+    async def upsert_planner(self, hashed_member: str, assoc: str, desired_handle: str) -> Optional[str]:
+        return await self.write(chat_db.upsert_planner, hashed_member, assoc, desired_handle)
+
+    async def set_planner_online(self, planner_id: int, online: bool) -> None:
+        return await self.write(chat_db.set_planner_online, planner_id, online)
+
+    async def planner_heartbeat(self, planner_id: int) -> bool:
+        return await self.write(chat_db.planner_heartbeat, planner_id)
+
+    async def create_thread(self, customer_id: int, planner_id: int) -> int:
+        return await self.write(chat_db.create_thread, customer_id, planner_id)
+
+    async def add_message(self, thread_id: int, sender: str, content: str) -> int:
+        return await asyncio.wrap_future(chat_db.add_message_buffered(thread_id, sender, content, self.path))
+
+    async def rate_thread(self, thread_id: int, rating: int, feedback: str) -> Optional[dict]:
+        return await self.write(chat_db.rate_thread, thread_id, rating, feedback)
+
+    async def set_thread_paid(self, thread_id: int, flag: int) -> None:
+        await asyncio.wrap_future(chat_db.set_thread_paid_buffered(thread_id, flag, self.path))
+
+    async def set_thread_released(self, thread_id: int, flag: int) -> None:
+        return await self.write(chat_db.set_thread_released, thread_id, flag)
+
+    async def set_thread_status(self, thread_id: int, status: str) -> None:
+        return await self.write(chat_db.set_thread_status, thread_id, status)
+
+    # ---- Lesen (parallel über die Reader-Threads) ----
+    async def get_planner_by_hash(self, hashed_member: str):
+        return await self.read(chat_db.get_planner_by_hash, hashed_member)
+
+    async def get_planner_by_handle(self, handle: str):
+        return await self.read(chat_db.get_planner_by_handle, handle)
+
+    async def customer_exists(self, customer_id: int) -> bool:
+        return await self.read(chat_db.customer_exists, customer_id)
+
+    async def pick_planner(self, handle: str = "") -> Optional[int]:
+        return await self.read(chat_db.pick_planner, handle)
+
+    async def get_user_threads(self, role: str, user_id: int) -> list:
+        return await self.read(chat_db.get_user_threads, role, user_id)
+
+    async def get_messages(self, thread_id: int) -> list:
+        return await self.read(chat_db.get_messages, thread_id)
+
+    async def get_messages_after(self, thread_id: int, after_id: int = 0) -> list:
+        return await self.read(chat_db.get_messages_after, thread_id, after_id)
+
+    async def get_messages_before(self, thread_id: int, before_id: Optional[int] = None,
+                                  limit: int = chat_db.MESSAGE_PAGE_SIZE) -> list:
+        return await self.read(chat_db.get_messages_before, thread_id, before_id, limit)
+
+    async def search_messages(self, text: str, planner_id: Optional[int] = None, page: int = 0) -> list:
+        return await self.read(chat_db.search_messages, text, planner_id=planner_id, page=page)
+
+    async def get_planner_score(self, planner_id: int) -> int:
+        return await self.read(chat_db.get_planner_score, planner_id)
+
+    async def get_thread_state(self, thread_id: int) -> dict:
+        return await self.read(chat_db.get_thread_state, thread_id)
+
+    async def get_thread_summary(self, thread_id: int) -> Optional[dict]:
+        return await self.read(chat_db.get_thread_summary, thread_id)
+
+    # ---- Benachrichtigung (ohne DB, ohne Thread) ----
+    def list_online_planners(self, k: Optional[int] = None) -> list:
+        return chat_db.list_online_planners(k=k)
+
+    async def wait_for_change(self, key, seen: int, timeout: float = 25.0) -> int:
+        return await chat_db.CHANGES.wait_async(key, seen, timeout)
+
+# ----------------- Benchmark -----------------
+async def _bench(path: str, sessions: int, per_session: int) -> dict:
+    """Viele gleichzeitige Sitzungen in einem Event-Loop: schreiben, dann inkrementell lesen."""
+    async with AsyncChatDB(path) as db:
+        cid = await db.ensure_customer("bench")
+        await db.upsert_planner("bench", "bench", "bench")
+        thread_ids = [await db.create_thread(cid, 1) for _ in range(sessions)]
+
+        async def session(tid: int) -> int:
+            last = 0
+            for i in range(per_session):
+                await db.add_message(tid, "customer", f"Nachricht {i}")
+                rows = await db.get_messages_after(tid, last)
+                last = rows[-1]["id"] if rows else last
+            return last
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(session(tid) for tid in thread_ids))
+        dt = time.perf_counter() - t0
+    ops = sessions * per_session * 2
+    return {"sessions": sessions, "ops": ops, "seconds": dt, "ops_per_s": ops / dt if dt else 0.0}
+
+if __name__ == "__main__":
+    import argparse
+    import tempfile
+    ap = argparse.ArgumentParser(description="FINAURA Chat – Async-Datenzugriff (Benchmark)")
+    ap.add_argument("--sessions", type=int, default=200, help="Gleichzeitige Chat-Sitzungen")
+    ap.add_argument("--messages", type=int, default=20, help="Nachrichten pro Sitzung")
+    args = ap.parse_args()
+    with tempfile.TemporaryDirectory() as td:
+        r = asyncio.run(_bench(os.path.join(td, "async.db"), args.sessions, args.messages))
+        chat_db.get_pool(os.path.join(td, "async.db")).close_all()
+    print(f"{r['sessions']} Sitzungen, {r['ops']} Operationen in {r['seconds']:.2f} s "
+          f"({r['ops_per_s']:.0f} Ops/s, 1 Writer + {READER_THREADS} Reader-Threads)")
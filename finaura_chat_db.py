@@ -0,0 +1,1735 @@
+"""
+FINAURA Chat – Datenzugriff
+---------------------------
+
+Install (once):
+    pip install streamlit altair pandas
+
+Used by:
+    streamlit run finaura_chat_anon_v0_2_7.py
+
+SQLite data layer of the anonymous advisor chat (schema, helpers, payment
+state). Lives in its own module because Streamlit re-executes the app
+script on every rerun: module-level state here (connection pool) is
+imported once per process and shared by all sessions.
+
+Storage path:
+    FINAURA_DB_PATH (default: finaura_chat.db)
+
+Presence (Heartbeat-TTL, s):
+    FINAURA_PRESENCE_TTL_S (default: 90)
+
+Group commit (max. Wartezeit pro Batch, ms):
+    FINAURA_GROUP_COMMIT_MS (default: 0)
+
+Query-Metriken und Slow-Query-Log: siehe finaura_chat_trace.py
+"""
+
+from __future__ import annotations
+import os
+import queue
+import re
+import sqlite3
+import bisect
+import hashlib
+import heapq
+import secrets
+import threading
+import time
+import weakref
+from concurrent.futures import Future
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Optional
+
+from finaura_chat_trace import SQL_TRACE, TracedConnection
+
+DB_PATH = os.getenv("FINAURA_DB_PATH", "finaura_chat.db")
+
+# Pro Verbindung beim Öffnen gesetzt. WAL: Leser blockieren Schreiber nicht mehr;
+# synchronous=NORMAL ist in WAL absturzsicher (nur die letzten Commits können
+# bei Stromausfall verloren gehen); busy_timeout statt sofortigem "database is locked".
+SQLITE_PRAGMAS = {
+    "busy_timeout": 5000,            # ms (zuerst setzen: die folgenden Pragmas können selbst warten müssen)
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "mmap_size": 256 * 1024 * 1024,  # bytes
+    "cache_size": -16000,            # KiB (negativ = Grösse statt Seiten)
+    "temp_store": "MEMORY",
+    "wal_autocheckpoint": 1000,      # Seiten
+    "journal_size_limit": 64 * 1024 * 1024,
+}
+CHECKPOINT_INTERVAL_S = 60.0
+MESSAGE_PAGE_SIZE = 50  # Nachrichten pro Seite (neueste zuerst, "Ältere laden")
+FALLBACK_POLL_S = 15.0  # Nachrichten trotzdem prüfen, falls ein anderer Prozess schreibt
+
+# ---------- Connection-Pool ----------
+class ConnectionPool:
+    """Prozessweiter Pool für SQLite-Verbindungen.
+
+    - `connection()`: Kontextmanager, gibt die Verbindung danach zurück
+    - `thread_connection()`: eine Verbindung pro Thread (= pro Streamlit-Rerun);
+      zurück an den Pool mit `release_thread_connection()` bzw. am Ende von
+      `thread_scope()` – das Thread-Ende (GC des Thread-Objekts) ist nur die Rückfallebene
+    - Health-Check (`SELECT 1`) bei Wiederverwendung, offene Transaktionen
+      werden bei der Rückgabe zurückgerollt
+    """
+
+    def __init__(self, path: str, max_idle: int = 8, pragmas: Optional[dict] = None):
+        self.path = path
+        self.max_idle = max_idle
+        self.pragmas = SQLITE_PRAGMAS if pragmas is None else pragmas
+        self._last_checkpoint = time.monotonic()
+        self._idle: list = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._stats = {"opened": 0, "reused": 0, "released": 0, "closed": 0, "health_failed": 0,
+                       "checkpoints": 0}
+
+    def _open(self) -> sqlite3.Connection:
+        timeout = self.pragmas.get("busy_timeout", 5000) / 1000  # 5 s = sqlite3-Default
+        conn = sqlite3.connect(self.path, check_same_thread=False, timeout=timeout,
+                               factory=TracedConnection if SQL_TRACE else sqlite3.Connection)
+        conn.row_factory = sqlite3.Row
+        # Level-Regel in SQL verfügbar machen (rate_thread: Score + Level in einem UPDATE)
+        conn.create_function("level_from_score", 1, level_from_score, deterministic=True)
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name}={value}")
+        with self._lock:
+            self._stats["opened"] += 1
+        return conn
+
+    def _close(self, conn: sqlite3.Connection) -> None:
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        with self._lock:
+            self._stats["closed"] += 1
+
+    def acquire(self) -> sqlite3.Connection:
+        while True:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                return self._open()
+            try:
+                conn.execute("SELECT 1").fetchone()
+            except sqlite3.Error:
+                with self._lock:
+                    self._stats["health_failed"] += 1
+                self._close(conn)
+                continue
+            with self._lock:
+                self._stats["reused"] += 1
+            return conn
+
+    def release(self, conn: sqlite3.Connection) -> None:
+        with self._lock:
+            if any(c is conn for c in self._idle):
+                return  # doppelte Rückgabe: sonst teilen sich später zwei Threads eine Verbindung
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            self._close(conn)
+            return
+        self._maybe_checkpoint(conn)
+        with self._lock:
+            self._stats["released"] += 1
+            if len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+        self._close(conn)
+
+    def _maybe_checkpoint(self, conn: sqlite3.Connection) -> None:
+        # Ergänzt wal_autocheckpoint: in ruhigen Phasen das WAL regelmässig zurückschreiben
+        if self.pragmas.get("journal_mode", "").upper() != "WAL":
+            return
+        with self._lock:
+            if time.monotonic() - self._last_checkpoint < CHECKPOINT_INTERVAL_S:
+                return
+            self._last_checkpoint = time.monotonic()
+        self.checkpoint("PASSIVE", conn)
+
+    def checkpoint(self, mode: str = "PASSIVE", conn: Optional[sqlite3.Connection] = None) -> tuple:
+        """PRAGMA wal_checkpoint(mode) → (busy, log_frames, checkpointed_frames)."""
+        if conn is None:
+            with self.connection() as c:
+                return self.checkpoint(mode, c)
+        try:
+            row = conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+        except sqlite3.Error:
+            return (1, -1, -1)
+        with self._lock:
+            self._stats["checkpoints"] += 1
+        return tuple(row)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def thread_connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            return conn
+        conn = self.acquire()
+        self._local.conn = conn
+        # Rückfallebene, falls niemand explizit zurückgibt: erst wenn das Thread-Objekt
+        # aufgeräumt wird – Script-Runner- und Executor-Threads leben oft länger
+        self._local.finalizer = weakref.finalize(threading.current_thread(), self.release, conn)
+        return conn
+
+    @contextmanager
+    def thread_scope(self):
+        """thread_connection() im Block; am Ende des äussersten Blocks zurück an den Pool."""
+        depth = getattr(self._local, "depth", 0)
+        self._local.depth = depth + 1
+        try:
+            yield
+        finally:
+            self._local.depth = depth
+            if depth == 0:
+                self.release_thread_connection()
+
+    def release_thread_connection(self) -> None:
+        """Explizite Rückgabe (z. B. am Ende eines Reruns oder eines Worker-Jobs)."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            self._local.conn = None
+            self._local.finalizer.detach()  # Thread-Ende soll nicht ein zweites Mal zurückgeben
+            self.release(conn)
+
+    def close_all(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        if idle and self.pragmas.get("journal_mode", "").upper() == "WAL":
+            self.checkpoint("TRUNCATE", idle[0])
+        for conn in idle:
+            self._close(conn)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats, idle=len(self._idle))
+
+_POOLS: dict = {}
+_POOLS_LOCK = threading.Lock()
+
+def get_pool(path: Optional[str] = None) -> ConnectionPool:
+    path = path or DB_PATH
+    with _POOLS_LOCK:
+        if path not in _POOLS:
+            _POOLS[path] = ConnectionPool(path)
+        return _POOLS[path]
+
+def pool_stats() -> dict:
+    return get_pool().stats()
+
+# ---------- Änderungs-Feed (In-Process Pub/Sub) ----------
+class ChangeFeed:
+    """Versionszähler je Schlüssel (Thread-ID oder ("planner", id) / ("customer", id)).
+
+    Der Schreibpfad ruft `publish()` nach dem Commit auf; Leser vergleichen ihre
+    zuletzt gesehene Version (reiner Speicherzugriff, keine DB-Abfrage) oder
+    blockieren mit `wait()` bis zur nächsten Änderung (Long-Polling); in asyncio
+    ohne eigenen Thread pro Wartendem mit `wait_async()`.
+    Gilt pro Prozess – Schreiber in anderen Prozessen sieht nur der Fallback-Poll.
+    """
+
+    def __init__(self):
+        self._versions: dict = {}
+        self._cond = threading.Condition()
+        self._async_waiters: dict = {}  # key -> [(loop, future)]
+
+    def publish(self, *keys) -> None:
+        with self._cond:
+            for key in keys:
+                self._versions[key] = self._versions.get(key, 0) + 1
+                for loop, fut in self._async_waiters.pop(key, ()):
+                    try:
+                        loop.call_soon_threadsafe(_resolve, fut, self._versions[key])
+                    except RuntimeError:
+                        pass  # Loop des Wartenden schon geschlossen – der Commit ist trotzdem gültig
+            self._cond.notify_all()
+
+    def version(self, key) -> int:
+        return self._versions.get(key, 0)
+
+    def wait(self, key, seen: int, timeout: float = 25.0) -> int:
+        """Blockiert, bis version(key) > seen oder timeout; liefert die aktuelle Version."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._versions.get(key, 0) > seen, timeout=timeout)
+            return self._versions.get(key, 0)
+
+    async def wait_async(self, key, seen: int, timeout: float = 25.0) -> int:
+        """Wie wait(), aber als Coroutine: wartet auf ein Future statt einen Thread zu blockieren."""
+        import asyncio
+        loop = asyncio.get_running_loop()
+        with self._cond:
+            current = self._versions.get(key, 0)
+            if current > seen:
+                return current
+            fut = loop.create_future()
+            self._async_waiters.setdefault(key, []).append((loop, fut))
+        try:
+            return await asyncio.wait_for(fut, timeout)
+        except asyncio.TimeoutError:
+            return self.version(key)
+        finally:
+            # Auch bei Abbruch (Client weg, Task cancelled) austragen, nicht erst beim nächsten publish()
+            with self._cond:
+                waiters = self._async_waiters.get(key)
+                if waiters is not None:
+                    if (loop, fut) in waiters:
+                        waiters.remove((loop, fut))
+                    if not waiters:
+                        self._async_waiters.pop(key, None)
+
+def _resolve(fut, value) -> None:
+    if not fut.done():
+        fut.set_result(value)
+
+CHANGES = ChangeFeed()
+
+# ---------- Group Commit (Write-Behind) ----------
+# Wartezeit auf weitere Schreiber pro Batch. 0 = alles committen, was bereits in der
+# Queue steht; während ein Commit läuft, sammeln sich die nächsten Einträge ohnehin an.
+GROUP_COMMIT_MAX_ROWS = 256
+GROUP_COMMIT_DELAY_MS = float(os.getenv("FINAURA_GROUP_COMMIT_MS", "0"))
+GROUP_COMMIT_TIMEOUT_S = 15.0  # max. Wartezeit auf die Bestätigung (z. B. .result() in der UI)
+
+class GroupCommitWriter:
+    """Ein Writer-Thread bündelt Schreiboperationen zu einer Transaktion.
+
+    `submit(fn, *args)` reiht fn(conn, *args) ein und liefert ein Future; die
+    Transaktion wird nach `max_delay_ms` oder `max_rows` Operationen committet
+    und erst danach werden die Futures erfüllt (= committet; mit synchronous=NORMAL
+    können die letzten Commits bei Stromausfall noch verloren gehen, siehe SQLITE_PRAGMAS).
+    Jede Operation läuft in einem SAVEPOINT, ein Fehler trifft nur ihr Future.
+    `on_commit(result)` läuft nach dem Commit (z. B. CHANGES.publish).
+    """
+
+    def __init__(self, pool: "ConnectionPool", max_rows: int = GROUP_COMMIT_MAX_ROWS,
+                 max_delay_ms: float = GROUP_COMMIT_DELAY_MS):
+        self.pool = pool
+        self.max_rows = max_rows
+        self.max_delay = max_delay_ms / 1000
+        self._queue: queue.Queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._stats = {"ops": 0, "batches": 0, "failed": 0, "hook_errors": 0, "max_batch": 0}
+        self._thread = threading.Thread(target=self._run, name="finaura-group-commit", daemon=True)
+        self._thread.start()
+
+    def submit(self, fn, *args, on_commit=None) -> Future:
+        fut: Future = Future()
+        self._queue.put((fn, args, on_commit, fut))
+        return fut
+
+    def _collect(self) -> Optional[list]:
+        item = self._queue.get()
+        if item is None:
+            return None
+        batch = [item]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_rows:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)  # Stop nach diesem Batch
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self) -> None:
+        conn = self.pool.acquire()
+        try:
+            while True:
+                batch = self._collect()
+                if batch is None:
+                    return
+                try:
+                    self._apply(conn, batch)
+                except BaseException as e:  # letzte Sicherung: kein Future bleibt offen
+                    self._fail([item[3] for item in batch], e)
+                    raise
+        finally:
+            self.pool.release(conn)
+
+    @staticmethod
+    def _fail(futures, exc: BaseException) -> None:
+        for fut in futures:
+            if not fut.done():
+                fut.set_exception(exc)
+
+    def _apply(self, conn, batch: list) -> None:
+        running = [item for item in batch if item[3].set_running_or_notify_cancel()]
+        futures = [item[3] for item in running]
+        done = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for fn, args, on_commit, fut in running:
+                conn.execute("SAVEPOINT op")
+                try:
+                    result = fn(conn, *args)
+                except Exception as e:
+                    # Schlägt das Zurückrollen fehl (SQLite hat z. B. selbst abgebrochen),
+                    # ist der Zustand der Transaktion unklar -> ganzer Batch scheitert
+                    conn.execute("ROLLBACK TO op")
+                    conn.execute("RELEASE op")
+                    fut.set_exception(e)
+                    continue
+                conn.execute("RELEASE op")
+                done.append((fut, result, on_commit))
+            conn.commit()
+        except Exception as e:
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                pass
+            self._fail(futures, e)
+            with self._lock:
+                self._stats["failed"] += len(futures)
+            return
+        for fut, result, on_commit in done:
+            # Hooks dürfen den Writer nicht stoppen: die Zeile ist bereits committet
+            try:
+                if on_commit:
+                    on_commit(result)
+            except Exception:
+                with self._lock:
+                    self._stats["hook_errors"] += 1
+            fut.set_result(result)
+        with self._lock:
+            self._stats["ops"] += len(done)
+            self._stats["batches"] += 1
+            self._stats["max_batch"] = max(self._stats["max_batch"], len(batch))
+
+    def close(self) -> None:
+        """Restliche Einträge committen und den Writer beenden."""
+        self._queue.put(None)
+        self._thread.join()
+
+    def stats(self) -> dict:
+        with self._lock:
+            s = dict(self._stats)
+        s["avg_batch"] = s["ops"] / s["batches"] if s["batches"] else 0.0
+        return s
+
+_WRITERS: dict = {}
+
+def get_writer(path: Optional[str] = None) -> GroupCommitWriter:
+    pool = get_pool(path)
+    with _POOLS_LOCK:
+        w = _WRITERS.get(pool.path)
+        if w is None or not w._thread.is_alive():
+            w = _WRITERS[pool.path] = GroupCommitWriter(pool)
+        return w
+
+# ---------- Präsenz (In-Memory, Heartbeat + TTL) ----------
+PRESENCE_TTL_S = float(os.getenv("FINAURA_PRESENCE_TTL_S", "90"))
+PRESENCE_HEARTBEAT_S = 30       # Berater-Sitzungen melden sich in diesem Takt
+PRESENCE_PERSIST_S = 60.0       # planners.is_online höchstens so oft nachführen
+
+class PresenceRegistry:
+    """Wer ist online – prozessweit, für alle Sitzungen geteilt.
+
+    Berater gelten als online, solange innerhalb von `ttl` ein Heartbeat kam;
+    wer den Tab schliesst, läuft automatisch ab. `_ranked` bleibt nach
+    (Score absteigend, Handle) sortiert, damit `online(k)` nur k Einträge kopiert.
+    Abgelaufene Einträge werden lazy über einen Heap der Ablaufzeiten entfernt.
+    """
+
+    def __init__(self, ttl: float = PRESENCE_TTL_S):
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        self._entries: dict = {}    # id -> {"id", "handle", "level", "score", "last_seen"}
+        self._ranked: list = []     # [(-score, handle, id)]
+        self._deadlines: list = []  # Heap [(ablauf, id)], veraltete Einträge werden übersprungen
+        self._persisted_at = 0.0
+        self._listeners: list = []
+
+    def subscribe(self, fn) -> None:
+        """fn(planner_id, eintrag) bei Beitritt/Score-Änderung, fn(planner_id, None) beim Verlassen."""
+        self._listeners.append(fn)
+
+    def _notify(self, planner_id: int, e: Optional[dict]) -> None:
+        for fn in self._listeners:
+            fn(planner_id, dict(e) if e else None)
+
+    def _key(self, e: dict) -> tuple:
+        return (-e["score"], e["handle"], e["id"])
+
+    def _drop(self, planner_id: int, notify: bool = True) -> None:
+        e = self._entries.pop(planner_id, None)
+        if e is not None:
+            i = bisect.bisect_left(self._ranked, self._key(e))
+            if i < len(self._ranked) and self._ranked[i][2] == planner_id:
+                del self._ranked[i]
+            if notify:
+                self._notify(planner_id, None)
+
+    def _expire(self, now: float) -> None:
+        while self._deadlines and self._deadlines[0][0] <= now:
+            _, pid = heapq.heappop(self._deadlines)
+            e = self._entries.get(pid)
+            if e is not None and e["last_seen"] + self.ttl <= now:
+                self._drop(pid)
+
+    def heartbeat(self, planner_id: int, handle: Optional[str] = None,
+                  level: Optional[str] = None, score: Optional[int] = None) -> bool:
+        """Lebenszeichen; neue Einträge brauchen handle/level/score. False = unbekannt."""
+        now = time.monotonic()
+        with self._lock:
+            e = self._entries.get(planner_id)
+            if e is None:
+                if handle is None:
+                    return False
+                e = {"id": planner_id, "handle": handle, "level": level, "score": int(score or 0)}
+                self._entries[planner_id] = e
+                bisect.insort(self._ranked, self._key(e))
+                self._notify(planner_id, e)
+            e["last_seen"] = now
+            heapq.heappush(self._deadlines, (now + self.ttl, planner_id))
+            return True
+
+    def leave(self, planner_id: int) -> None:
+        with self._lock:
+            self._drop(planner_id)
+
+    def update_score(self, planner_id: int, score: int, level: str) -> None:
+        """Nach einer Bewertung neu einsortieren (nur falls online)."""
+        with self._lock:
+            e = self._entries.get(planner_id)
+            if e is None:
+                return
+            self._drop(planner_id, notify=False)
+            e.update(score=int(score), level=level)
+            self._entries[planner_id] = e
+            bisect.insort(self._ranked, self._key(e))
+            self._notify(planner_id, e)
+
+    def sweep(self) -> None:
+        """Abgelaufene Einträge jetzt entfernen (sonst erst beim nächsten Lesen)."""
+        with self._lock:
+            self._expire(time.monotonic())
+
+    def online(self, k: Optional[int] = None) -> list:
+        """Die k besten Online-Berater (Score absteigend, dann Handle)."""
+        with self._lock:
+            self._expire(time.monotonic())
+            ranked = self._ranked if k is None else self._ranked[:k]
+            return [{key: self._entries[pid][key] for key in ("id", "handle", "level", "score")}
+                    for _, _, pid in ranked]
+
+    def is_online(self, planner_id: int) -> bool:
+        with self._lock:
+            self._expire(time.monotonic())
+            return planner_id in self._entries
+
+    def persist(self, conn, force: bool = False) -> bool:
+        """planners.is_online als Schnappschuss nachführen (für andere Prozesse/Auswertungen)."""
+        now = time.monotonic()
+        with self._lock:
+            if not force and now - self._persisted_at < PRESENCE_PERSIST_S:
+                return False
+            self._persisted_at = now
+            self._expire(now)
+            ids = list(self._entries)
+        marks = ",".join("?" * len(ids))
+        conn.execute(f"UPDATE planners SET is_online = (id IN ({marks})) "
+                     f"WHERE is_online != (id IN ({marks}))", ids + ids)
+        conn.commit()
+        return True
+
+PRESENCE = PresenceRegistry()
+
+# ---------- Auto-Zuweisung (lastabhängig) ----------
+class AssignmentScheduler:
+    """Wählt für neue Threads den Online-Berater mit der geringsten offenen Last.
+
+    Last = W_PAID × bezahlte + W_UNPAID × unbezahlte offene Threads (bezahlte
+    Tickets warten auf eine Antwort, unbezahlte evtl. nie). Gleichstand: höherer
+    Score zuerst. Min-Heap mit Versionsnummern: jede Laständerung legt einen neuen
+    Eintrag an (O(log n)), veraltete werden beim Auswählen verworfen.
+    Mitglieder kommen aus dem Präsenz-Register; unbekannte Lasten werden beim
+    nächsten `pick(conn)` aus der DB gelesen.
+    """
+
+    W_PAID = 1.0
+    W_UNPAID = 0.3
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._heap: list = []       # [(last, -score, id, version)]
+        self._state: dict = {}      # id -> {"score", "paid", "unpaid", "version", "known"}
+
+    def _cost(self, s: dict) -> float:
+        return self.W_PAID * s["paid"] + self.W_UNPAID * s["unpaid"]
+
+    def _push(self, planner_id: int) -> None:
+        s = self._state[planner_id]
+        s["version"] += 1
+        if s["known"]:
+            heapq.heappush(self._heap, (self._cost(s), -s["score"], planner_id, s["version"]))
+        if len(self._heap) > 4 * len(self._state) + 64:
+            self._heap = [(self._cost(v), -v["score"], k, v["version"])
+                          for k, v in self._state.items() if v["known"]]
+            heapq.heapify(self._heap)
+
+    def join(self, planner_id: int, score: int, paid: Optional[int] = None, unpaid: Optional[int] = None) -> None:
+        with self._lock:
+            s = self._state.setdefault(planner_id, {"score": 0, "paid": 0, "unpaid": 0, "version": 0, "known": False})
+            s["score"] = int(score)
+            if paid is not None:
+                s.update(paid=paid, unpaid=unpaid or 0, known=True)
+            self._push(planner_id)
+
+    def leave(self, planner_id: int) -> None:
+        with self._lock:
+            self._state.pop(planner_id, None)
+
+    def on_presence(self, planner_id: int, entry: Optional[dict]) -> None:
+        if entry is None:
+            self.leave(planner_id)
+        else:
+            self.join(planner_id, entry["score"])
+
+    def adjust(self, planner_id: int, paid: int = 0, unpaid: int = 0) -> None:
+        """Bekannte Laständerung (z. B. neuer Thread) ohne DB-Abfrage nachführen."""
+        with self._lock:
+            s = self._state.get(planner_id)
+            if s is None or not s["known"]:
+                return
+            s["paid"] = max(0, s["paid"] + paid)
+            s["unpaid"] = max(0, s["unpaid"] + unpaid)
+            self._push(planner_id)
+
+    def invalidate(self, planner_id: Optional[int]) -> None:
+        """Last beim nächsten pick() neu aus der DB lesen (Status-/Zahlungswechsel)."""
+        with self._lock:
+            s = self._state.get(planner_id)
+            if s is not None and s["known"]:
+                s["known"] = False
+                s["version"] += 1
+
+    def _load_unknown(self, conn) -> None:
+        for pid, s in self._state.items():
+            if not s["known"]:
+                paid, total = conn.execute(SQL_PLANNER_LOAD, (pid,)).fetchone()
+                s.update(paid=paid or 0, unpaid=total - (paid or 0), known=True)
+                self._push(pid)
+
+    def pick(self, conn=None) -> Optional[int]:
+        """Berater mit der geringsten Last (None, wenn niemand online ist)."""
+        with self._lock:
+            if conn is not None:
+                self._load_unknown(conn)
+            while self._heap:
+                _, _, pid, version = self._heap[0]
+                s = self._state.get(pid)
+                if s is not None and s["version"] == version:
+                    return pid
+                heapq.heappop(self._heap)
+            return None
+
+    def loads(self) -> dict:
+        with self._lock:
+            return {pid: {"paid": s["paid"], "unpaid": s["unpaid"], "score": s["score"]}
+                    for pid, s in self._state.items() if s["known"]}
+
+SCHEDULER = AssignmentScheduler()
+PRESENCE.subscribe(SCHEDULER.on_presence)
+
+# ---------- Hot Queries ----------
+SQL_GET_MESSAGES = "SELECT sender, content, ts FROM messages WHERE thread_id=? ORDER BY id ASC"
+SQL_MESSAGES_AFTER = "SELECT id, sender, content, ts FROM messages WHERE thread_id=? AND id>? ORDER BY id ASC"
+# Keyset-Pagination: Seite vor einer id (neueste zuerst), ohne OFFSET
+SQL_MESSAGES_BEFORE = "SELECT id, sender, content, ts FROM messages WHERE thread_id=? AND id<? ORDER BY id DESC LIMIT ?"
+# thread_summary (Migration 7, per Trigger aktuell): Listen und Gates ohne Joins/Zählungen
+_SUMMARY_COLUMNS = """thread_id AS id, status, anon_id, handle, paid, released, message_count,
+           has_planner_reply, last_message_ts, rating"""
+SQL_PLANNER_THREADS = f"SELECT {_SUMMARY_COLUMNS} FROM thread_summary WHERE planner_id=? ORDER BY thread_id DESC"
+SQL_CUSTOMER_THREADS = f"SELECT {_SUMMARY_COLUMNS} FROM thread_summary WHERE customer_id=? ORDER BY thread_id DESC"
+SQL_THREAD_SUMMARY = f"SELECT {_SUMMARY_COLUMNS}, planner_messages FROM thread_summary WHERE thread_id=?"
+SQL_ANY_PLANNER = "SELECT id FROM planners ORDER BY score DESC LIMIT 1"
+# Volltextsuche: Rangfolge (bm25) liefert FTS5 direkt, ohne Sortierung
+_SQL_SEARCH = """
+    SELECT m.id, m.thread_id, m.sender, m.ts,
+           snippet(messages_fts, 0, char(2), char(3), '…', 16) AS snippet, messages_fts.rank AS rank
+    FROM messages_fts
+    JOIN messages m ON m.id = messages_fts.rowid
+    JOIN threads t ON t.id = m.thread_id
+    WHERE messages_fts MATCH ?{scope}
+    ORDER BY messages_fts.rank
+    LIMIT ? OFFSET ?
+"""
+SQL_SEARCH_PLANNER = _SQL_SEARCH.format(scope=" AND t.planner_id = ?")
+SQL_SEARCH_ALL = _SQL_SEARCH.format(scope="")
+# Archiv (finaura_chat_archive): Kandidaten = abgeschlossen, freigegeben, letzte Nachricht vor Stichtag
+SQL_ARCHIVE_CANDIDATES = """
+    SELECT t.id, t.customer_id, t.planner_id, 'closed' AS status, t.created_at
+    FROM threads t
+    WHERE t.status = 'closed' AND t.released = 1
+      AND COALESCE((SELECT m.ts FROM messages m WHERE m.thread_id = t.id ORDER BY m.id DESC LIMIT 1),
+                   t.created_at) < ?
+    ORDER BY t.id
+    LIMIT ?
+"""
+SQL_ARCHIVED_CUSTOMER = "SELECT thread_id AS id, status, archive FROM archived_threads WHERE customer_id=? ORDER BY thread_id DESC"
+SQL_ARCHIVED_PLANNER = "SELECT thread_id AS id, status, archive FROM archived_threads WHERE planner_id=? ORDER BY thread_id DESC"
+SQL_PLANNER_LOAD = "SELECT SUM(paid = 1), COUNT(*) FROM threads WHERE planner_id=? AND COALESCE(status, 'open') != 'closed'"
+
+# name -> (sql, beispiel-parameter); von check_query_plans() geprüft
+HOT_QUERIES = {
+    "get_messages": (SQL_GET_MESSAGES, (1,)),
+    "messages_after": (SQL_MESSAGES_AFTER, (1, 0)),
+    "messages_before": (SQL_MESSAGES_BEFORE, (1, 2**62, 50)),
+    "thread_summary": (SQL_THREAD_SUMMARY, (1,)),
+    "planner_threads": (SQL_PLANNER_THREADS, (1,)),
+    "customer_threads": (SQL_CUSTOMER_THREADS, (1,)),
+    "any_planner": (SQL_ANY_PLANNER, ()),
+    "planner_load": (SQL_PLANNER_LOAD, (1,)),
+    "archive_candidates": (SQL_ARCHIVE_CANDIDATES, ("2025-01-01", 200)),
+    "archived_customer": (SQL_ARCHIVED_CUSTOMER, (1,)),
+    "archived_planner": (SQL_ARCHIVED_PLANNER, (1,)),
+    "search_planner": (SQL_SEARCH_PLANNER, ('"steuer"', 1, 20, 0)),
+    "search_all": (SQL_SEARCH_ALL, ('"steuer"', 20, 0)),
+}
+
+def explain(conn, sql: str, params: tuple = ()) -> list:
+    return [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+
+def check_query_plans(conn) -> dict:
+    """Liefert {name: [plan-zeilen]} für alle Hot Queries, die einen Tabellen-Scan
+    oder eine temporäre Sortierung brauchen. Leeres Dict = alles über Indizes.
+
+    Auf einer frischen Verbindung ausführen (gecachte Statements sehen Index-Änderungen nicht)."""
+    bad = {}
+    for name, (sql, params) in HOT_QUERIES.items():
+        plan = explain(conn, sql, params)
+        # SCAN ohne Index oder über einen nicht abdeckenden Index = Tabellen-Scan;
+        # erlaubt ist nur SCAN über einen COVERING INDEX (z. B. ORDER BY … LIMIT 1)
+        # oder über den FTS5-Index (VIRTUAL TABLE INDEX)
+        offending = [d for d in plan
+                     if (d.startswith("SCAN ") and "COVERING INDEX" not in d and "VIRTUAL TABLE INDEX" not in d)
+                     or "TEMP B-TREE" in d]
+        if offending:
+            bad[name] = plan
+    return bad
+
+# ---------- Utilities ----------
+def get_db():
+    """Verbindung des aktuellen Threads aus dem Pool (mehrfacher Aufruf pro Rerun = dieselbe Verbindung)."""
+    return get_pool().thread_connection()
+
+def db_scope():
+    """Kontext für einen Rerun/Job: get_db()-Verbindung danach an den Pool zurückgeben."""
+    return get_pool().thread_scope()
+
+# ---------- Schema-Migrationen ----------
+def _add_thread_payment_columns(conn):
+    # Ältere Datenbanken (< 0.2.7) haben paid/released noch nicht
+    cols = {row[1] for row in conn.execute("PRAGMA table_info(threads)")}
+    if "paid" not in cols:
+        conn.execute("ALTER TABLE threads ADD COLUMN paid INTEGER DEFAULT 0")
+    if "released" not in cols:
+        conn.execute("ALTER TABLE threads ADD COLUMN released INTEGER DEFAULT 0")
+    if "status" not in cols:
+        conn.execute("ALTER TABLE threads ADD COLUMN status TEXT DEFAULT 'open'")
+
+# (version, beschreibung, schritte) – Schritte sind SQL-Strings oder callables(conn).
+# Nur anhängen, nie bestehende Einträge ändern: PRAGMA user_version merkt sich den Stand.
+MIGRATIONS = [
+    (1, "Basisschema", [
+        """
+        CREATE TABLE IF NOT EXISTS planners (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            hashed_member TEXT UNIQUE,
+            assoc TEXT,
+            handle TEXT UNIQUE,
+            score INTEGER DEFAULT 0,
+            level TEXT DEFAULT 'Bronze',
+            created_at TEXT,
+            is_online INTEGER DEFAULT 0
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS customers (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            anon_id TEXT UNIQUE,
+            created_at TEXT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS threads (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            customer_id INTEGER,
+            planner_id INTEGER,
+            status TEXT DEFAULT 'open', -- open, closed
+            created_at TEXT,
+            FOREIGN KEY (customer_id) REFERENCES customers(id),
+            FOREIGN KEY (planner_id) REFERENCES planners(id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            thread_id INTEGER,
+            sender TEXT, -- 'planner' | 'customer'
+            content TEXT,
+            ts TEXT,
+            FOREIGN KEY (thread_id) REFERENCES threads(id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS ratings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            thread_id INTEGER UNIQUE,
+            score INTEGER, -- 1..5
+            feedback TEXT,
+            created_at TEXT,
+            FOREIGN KEY (thread_id) REFERENCES threads(id)
+        )
+        """,
+    ]),
+    (2, "Zahlungs-Spalten threads.paid/released", [_add_thread_payment_columns]),
+    (3, "Indizes für Hot Queries", [
+        "CREATE INDEX IF NOT EXISTS idx_messages_thread ON messages(thread_id, id)",
+        "CREATE INDEX IF NOT EXISTS idx_threads_planner ON threads(planner_id, id)",
+        "CREATE INDEX IF NOT EXISTS idx_threads_customer ON threads(customer_id, id)",
+        "CREATE INDEX IF NOT EXISTS idx_planners_online_score ON planners(is_online, score DESC, handle, id, level)",
+        "CREATE INDEX IF NOT EXISTS idx_planners_score ON planners(score DESC)",
+    ]),
+    (4, "Absender-Zähler je Thread ohne Sortierung", [
+        "CREATE INDEX IF NOT EXISTS idx_messages_thread_sender ON messages(thread_id, sender)",
+    ]),
+    (5, "Volltextsuche messages_fts (FTS5, per Trigger synchron)", [
+        # External-Content-Tabelle: Text liegt nur in messages, FTS hält nur den Index
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+            content, content='messages', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS messages_fts_ai AFTER INSERT ON messages BEGIN
+            INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS messages_fts_ad AFTER DELETE ON messages BEGIN
+            INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS messages_fts_au AFTER UPDATE OF content ON messages BEGIN
+            INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+            INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content);
+        END
+        """,
+        "INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')",
+    ]),
+    (6, "Archiv-Verzeichnis archived_threads (Hot/Cold)", [
+        """
+        CREATE TABLE IF NOT EXISTS archived_threads (
+            thread_id INTEGER PRIMARY KEY,
+            customer_id INTEGER,
+            planner_id INTEGER,
+            status TEXT,
+            created_at TEXT,
+            archive TEXT NOT NULL,      -- Dateiname der Archiv-DB
+            archived_at TEXT
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_archived_customer ON archived_threads(customer_id, thread_id)",
+        "CREATE INDEX IF NOT EXISTS idx_archived_planner ON archived_threads(planner_id, thread_id)",
+        # Partieller, abdeckender Index: nur archivierbare Threads, bleibt klein
+        "CREATE INDEX IF NOT EXISTS idx_threads_archivable ON threads(id, customer_id, planner_id, created_at, status, released) "
+        "WHERE status = 'closed' AND released = 1",
+    ]),
+    (7, "Denormalisierte thread_summary (per Trigger aktuell)", [
+        """
+        CREATE TABLE IF NOT EXISTS thread_summary (
+            thread_id INTEGER PRIMARY KEY,
+            customer_id INTEGER,
+            planner_id INTEGER,
+            anon_id TEXT,
+            handle TEXT,
+            status TEXT,
+            paid INTEGER DEFAULT 0,
+            released INTEGER DEFAULT 0,
+            created_at TEXT,
+            message_count INTEGER DEFAULT 0,
+            planner_messages INTEGER DEFAULT 0,
+            has_planner_reply INTEGER GENERATED ALWAYS AS (planner_messages > 0) VIRTUAL,
+            last_message_id INTEGER,
+            last_message_ts TEXT,
+            rating INTEGER
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_summary_planner ON thread_summary(planner_id, thread_id)",
+        "CREATE INDEX IF NOT EXISTS idx_summary_customer ON thread_summary(customer_id, thread_id)",
+        """
+        CREATE TRIGGER IF NOT EXISTS thread_summary_threads_ai AFTER INSERT ON threads BEGIN
+            INSERT OR REPLACE INTO thread_summary(thread_id, customer_id, planner_id, anon_id, handle,
+                                                  status, paid, released, created_at)
+            VALUES (new.id, new.customer_id, new.planner_id,
+                    (SELECT anon_id FROM customers WHERE id = new.customer_id),
+                    (SELECT handle FROM planners WHERE id = new.planner_id),
+                    COALESCE(new.status, 'open'), COALESCE(new.paid, 0), COALESCE(new.released, 0), new.created_at);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS thread_summary_threads_au
+        AFTER UPDATE OF status, paid, released, planner_id, customer_id ON threads BEGIN
+            UPDATE thread_summary
+            SET status = COALESCE(new.status, 'open'), paid = COALESCE(new.paid, 0),
+                released = COALESCE(new.released, 0), customer_id = new.customer_id, planner_id = new.planner_id,
+                anon_id = CASE WHEN new.customer_id IS old.customer_id THEN anon_id
+                               ELSE (SELECT anon_id FROM customers WHERE id = new.customer_id) END,
+                handle = CASE WHEN new.planner_id IS old.planner_id THEN handle
+                              ELSE (SELECT handle FROM planners WHERE id = new.planner_id) END
+            WHERE thread_id = new.id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS thread_summary_threads_ad AFTER DELETE ON threads BEGIN
+            DELETE FROM thread_summary WHERE thread_id = old.id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS thread_summary_messages_ai AFTER INSERT ON messages BEGIN
+            UPDATE thread_summary
+            SET message_count = message_count + 1,
+                planner_messages = planner_messages + (new.sender = 'planner'),
+                last_message_id = new.id, last_message_ts = new.ts
+            WHERE thread_id = new.thread_id;
+        END
+        """,
+        # Löschen nur beim Archivieren (danach fällt die ganze Zeile weg) – selten, darum Subquery
+        """
+        CREATE TRIGGER IF NOT EXISTS thread_summary_messages_ad AFTER DELETE ON messages BEGIN
+            UPDATE thread_summary
+            SET message_count = message_count - 1,
+                planner_messages = planner_messages - (old.sender = 'planner'),
+                last_message_id = (SELECT MAX(id) FROM messages WHERE thread_id = old.thread_id),
+                last_message_ts = (SELECT ts FROM messages WHERE thread_id = old.thread_id ORDER BY id DESC LIMIT 1)
+            WHERE thread_id = old.thread_id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS thread_summary_ratings_ai AFTER INSERT ON ratings BEGIN
+            UPDATE thread_summary SET rating = new.score WHERE thread_id = new.thread_id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS thread_summary_ratings_ad AFTER DELETE ON ratings BEGIN
+            UPDATE thread_summary SET rating = NULL WHERE thread_id = old.thread_id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS thread_summary_planners_au AFTER UPDATE OF handle ON planners BEGIN
+            UPDATE thread_summary SET handle = new.handle WHERE planner_id = new.id;
+        END
+        """,
+        # Bestand einmalig übernehmen
+        """
+        INSERT OR REPLACE INTO thread_summary(thread_id, customer_id, planner_id, anon_id, handle, status, paid,
+                                              released, created_at, message_count, planner_messages,
+                                              last_message_id, last_message_ts, rating)
+        SELECT t.id, t.customer_id, t.planner_id, c.anon_id, p.handle, COALESCE(t.status, 'open'),
+               COALESCE(t.paid, 0), COALESCE(t.released, 0), t.created_at,
+               COALESCE(agg.n, 0), COALESCE(agg.n_planner, 0), agg.last_id, lm.ts, r.score
+        FROM threads t
+        LEFT JOIN customers c ON c.id = t.customer_id
+        LEFT JOIN planners p ON p.id = t.planner_id
+        LEFT JOIN (SELECT thread_id, COUNT(*) AS n, SUM(sender = 'planner') AS n_planner, MAX(id) AS last_id
+                   FROM messages GROUP BY thread_id) agg ON agg.thread_id = t.id
+        LEFT JOIN messages lm ON lm.id = agg.last_id
+        LEFT JOIN ratings r ON r.thread_id = t.id
+        """,
+        # Ersetzt durch thread_summary.planner_messages; spart einen Index-Eintrag pro Nachricht
+        "DROP INDEX IF EXISTS idx_messages_thread_sender",
+    ]),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+_MIGRATED: set = set()
+_MIGRATE_LOCK = threading.Lock()
+
+def migrate(conn) -> int:
+    """Wendet ausstehende Migrationen in einer Transaktion an und liefert die Schema-Version.
+
+    BEGIN IMMEDIATE sperrt die DB für andere Prozesse; user_version wird innerhalb
+    der Sperre erneut gelesen, damit parallel startende Prozesse nichts doppelt ausführen.
+    """
+    if conn.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+        return SCHEMA_VERSION
+    if conn.in_transaction:
+        conn.commit()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for target, _desc, steps in MIGRATIONS:
+            if target <= version:
+                continue
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute(f"PRAGMA user_version={int(target)}")
+            version = target
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return version
+
+def init_db(conn=None):
+    """Schema einmal pro Prozess und Datenbank sicherstellen; weitere Aufrufe kosten nichts."""
+    path = None if conn is not None else get_pool().path
+    if path in _MIGRATED:
+        return
+    with _MIGRATE_LOCK:
+        if path in _MIGRATED:
+            return
+        migrate(conn or get_db())
+        if path is not None:
+            _MIGRATED.add(path)
+
+def now_iso():
+    return datetime.now(timezone.utc).isoformat()
+
+def salted_hash(member_id: str, assoc: str) -> str:
+    # Stable salted hash (do not reveal salt). For MVP a static salt; in prod use per-user salt stored server-side.
+    salt = "finaura_static_salt_v1"
+    return hashlib.sha256((salt + assoc.lower().strip() + ":" + member_id.strip()).encode()).hexdigest()
+
+def level_from_score(score: int) -> str:
+    if score >= 200: return "Platin"
+    if score >= 120: return "Gold"
+    if score >= 60:  return "Silber"
+    return "Bronze"
+
+def score_delta_for_rating(r: int) -> int:
+    return {1:-10, 2:-5, 3:0, 4:5, 5:10}.get(r, 0)
+
+def upsert_planner(conn, hashed_member: str, assoc: str, desired_handle: str) -> Optional[str]:
+    cur = conn.cursor()
+    # Ensure unique handle; if taken, append random 3 chars
+    handle = desired_handle.strip()
+    try:
+        cur.execute("INSERT INTO planners(hashed_member, assoc, handle, created_at) VALUES (?,?,?,?)",
+                    (hashed_member, assoc, handle, now_iso()))
+        conn.commit()
+        return handle
+    except sqlite3.IntegrityError:
+        # handle taken; try suffix
+        for _ in range(5):
+            candidate = f"{handle}_{secrets.token_hex(2)}"
+            try:
+                cur.execute("INSERT INTO planners(hashed_member, assoc, handle, created_at) VALUES (?,?,?,?)",
+                            (hashed_member, assoc, candidate, now_iso()))
+                conn.commit()
+                return candidate
+            except sqlite3.IntegrityError:
+                continue
+        return None
+
+def get_planner_by_hash(conn, hashed_member: str):
+    cur = conn.cursor()
+    cur.execute("SELECT * FROM planners WHERE hashed_member=?", (hashed_member,))
+    return cur.fetchone()
+
+def get_planner_by_handle(conn, handle: str):
+    return conn.execute("SELECT * FROM planners WHERE handle=?", (handle,)).fetchone()
+
+def customer_exists(conn, customer_id: int) -> bool:
+    return conn.execute("SELECT 1 FROM customers WHERE id=?", (customer_id,)).fetchone() is not None
+
+def set_planner_online(conn, planner_id: int, online: bool):
+    """An-/Abmeldung: Präsenz sofort setzen und is_online direkt mitschreiben."""
+    if online:
+        planner_heartbeat(conn, planner_id)
+    else:
+        PRESENCE.leave(planner_id)
+    cur = conn.cursor()
+    cur.execute("UPDATE planners SET is_online=? WHERE id=?", (1 if online else 0, planner_id))
+    conn.commit()
+
+def planner_heartbeat(conn, planner_id: int) -> bool:
+    """Lebenszeichen einer Berater-Sitzung; Stammdaten nur beim ersten Mal aus der DB.
+    False = unbekannte planner_id."""
+    if not PRESENCE.heartbeat(planner_id):
+        row = conn.execute("SELECT handle, level, score FROM planners WHERE id=?", (planner_id,)).fetchone()
+        if not row:
+            return False
+        PRESENCE.heartbeat(planner_id, row["handle"], row["level"], row["score"])
+    PRESENCE.persist(conn)
+    return True
+
+def list_online_planners(conn=None, k: Optional[int] = None) -> list:
+    """Online-Berater nach Score (aus dem Präsenz-Register, ohne DB-Zugriff)."""
+    return PRESENCE.online(k)
+
+def pick_planner(conn, handle: str = "") -> Optional[int]:
+    """Gewünschtes Handle, sonst geringste Last unter den Online-Beratern,
+    sonst bester Score überhaupt."""
+    cur = conn.cursor()
+    if handle.strip():
+        cur.execute("SELECT id FROM planners WHERE handle=?", (handle.strip(),))
+        row = cur.fetchone()
+    else:
+        PRESENCE.sweep()  # abgelaufene Einträge verlassen auch den Scheduler
+        pid = SCHEDULER.pick(conn)
+        row = {"id": pid} if pid is not None else None
+    if not row:
+        cur.execute(SQL_ANY_PLANNER)
+        row = cur.fetchone()
+    return row["id"] if row else None
+
+def ensure_customer(conn, anon_id: str):
+    cur = conn.cursor()
+    cur.execute("SELECT id FROM customers WHERE anon_id=?", (anon_id,))
+    row = cur.fetchone()
+    if row: return row["id"]
+    cur.execute("INSERT INTO customers(anon_id, created_at) VALUES (?,?)", (anon_id, now_iso()))
+    conn.commit()
+    return cur.lastrowid
+
+def create_thread(conn, customer_id: int, planner_id: int):
+    cur = conn.cursor()
+    cur.execute("INSERT INTO threads(customer_id, planner_id, status, created_at) VALUES (?,?, 'open', ?)",
+                (customer_id, planner_id, now_iso()))
+    conn.commit()
+    CHANGES.publish(("customer", customer_id), ("planner", planner_id))
+    SCHEDULER.adjust(planner_id, unpaid=1)
+    return cur.lastrowid
+
+def get_user_threads(conn, role: str, user_id: int):
+    cur = conn.cursor()
+    if role == "planner":
+        cur.execute(SQL_PLANNER_THREADS, (user_id,))
+    else:
+        cur.execute(SQL_CUSTOMER_THREADS, (user_id,))
+    return cur.fetchall()
+
+def _insert_message(conn, thread_id: int, sender: str, content: str) -> int:
+    cur = conn.execute("INSERT INTO messages(thread_id, sender, content, ts) VALUES (?,?,?,?)",
+                       (thread_id, sender, content, now_iso()))
+    return cur.lastrowid
+
+def add_message(conn, thread_id: int, sender: str, content: str) -> int:
+    mid = _insert_message(conn, thread_id, sender, content)
+    conn.commit()
+    CHANGES.publish(thread_id)
+    return mid
+
+def add_message_buffered(thread_id: int, sender: str, content: str, path: Optional[str] = None) -> Future:
+    """Wie add_message, aber über den Group-Commit-Writer; Future liefert die id nach dem Commit."""
+    return get_writer(path).submit(_insert_message, thread_id, sender, content,
+                                   on_commit=lambda _: CHANGES.publish(thread_id))
+
+def get_messages(conn, thread_id: int):
+    cur = conn.cursor()
+    cur.execute(SQL_GET_MESSAGES, (thread_id,))
+    return cur.fetchall()
+
+def get_messages_after(conn, thread_id: int, after_id: int = 0):
+    """Nur Nachrichten mit id > after_id (Cursor für inkrementelles Nachladen)."""
+    cur = conn.cursor()
+    cur.execute(SQL_MESSAGES_AFTER, (thread_id, after_id))
+    return cur.fetchall()
+
+def get_messages_before(conn, thread_id: int, before_id: Optional[int] = None,
+                        limit: int = MESSAGE_PAGE_SIZE) -> list:
+    """Bis zu `limit` Nachrichten mit id < before_id, chronologisch sortiert.
+    before_id=None = neueste Seite."""
+    cur = conn.cursor()
+    cur.execute(SQL_MESSAGES_BEFORE, (thread_id, before_id if before_id is not None else 2**62, limit))
+    return cur.fetchall()[::-1]
+
+SEARCH_PAGE_SIZE = 20
+SNIPPET_START, SNIPPET_END = "\x02", "\x03"  # Treffer-Markierung in `snippet`
+
+def fts_query(text: str) -> str:
+    """Freitext -> sichere FTS5-Abfrage: alle Wörter (UND), das letzte als Präfix."""
+    words = re.findall(r"\w+", text or "")
+    if not words:
+        return ""
+    terms = [f'"{w}"' for w in words]
+    terms[-1] += "*"
+    return " ".join(terms)
+
+def search_messages(conn, text: str, planner_id: Optional[int] = None,
+                    page: int = 0, page_size: int = SEARCH_PAGE_SIZE) -> list:
+    """Nach Relevanz sortierte Treffer; mit planner_id nur in dessen Threads,
+    ohne (Moderation) über alle Nachrichten."""
+    q = fts_query(text)
+    if not q:
+        return []
+    window = (page_size, page * page_size)
+    if planner_id is None:
+        rows = conn.execute(SQL_SEARCH_ALL, (q,) + window)
+    else:
+        rows = conn.execute(SQL_SEARCH_PLANNER, (q, planner_id) + window)
+    return [dict(r) for r in rows]
+
+class ThreadMessages:
+    """Sitzungs-Cache der Nachrichten eines Threads.
+
+    Geladen wird zuerst nur die neueste Seite; `load_older()` blättert per
+    Keyset (id < erste geladene id) zurück. `refresh()` holt nur Zeilen nach
+    der zuletzt gesehenen id; die Zähler je Absender kommen einmalig per
+    thread_summary und werden danach fortgeschrieben.
+    """
+
+    def __init__(self, thread_id: int, page_size: int = MESSAGE_PAGE_SIZE):
+        self.thread_id = thread_id
+        self.page_size = page_size
+        self.messages: list = []
+        self.last_id = 0
+        self.has_older = False
+        self.count_by_sender: dict = {}
+        self.loaded = False
+        self.seen_version = -1
+        self.checked_at = 0.0
+
+    @property
+    def has_planner(self) -> bool:
+        return self.count_by_sender.get("planner", 0) > 0
+
+    def stale(self, max_age_s: float = FALLBACK_POLL_S) -> bool:
+        """Neue Version im Feed – oder Fallback-Poll fällig (Schreiber in anderen Prozessen)."""
+        return (self.seen_version != CHANGES.version(self.thread_id)
+                or time.monotonic() - self.checked_at > max_age_s)
+
+    @property
+    def first_id(self) -> Optional[int]:
+        return self.messages[0]["id"] if self.messages else None
+
+    def load_older(self, conn, n: Optional[int] = None) -> list:
+        """Vorherige Seite vor der ersten geladenen Nachricht voranstellen."""
+        n = n or self.page_size
+        rows = [dict(r) for r in get_messages_before(conn, self.thread_id, self.first_id, n + 1)]
+        self.has_older = len(rows) > n
+        rows = rows[-n:]
+        self.messages[:0] = rows
+        return rows
+
+    def _initial_load(self, conn) -> None:
+        self.seen_version = CHANGES.version(self.thread_id)
+        self.checked_at = time.monotonic()
+        # Zähler und neueste Seite aus demselben Snapshot: sonst wird eine dazwischen
+        # committete Nachricht geladen, aber nie gezählt (has_planner bliebe False)
+        own = not conn.in_transaction
+        if own:
+            conn.execute("BEGIN")
+        try:
+            s = conn.execute(SQL_THREAD_SUMMARY, (self.thread_id,)).fetchone()
+            self.load_older(conn)
+        finally:
+            if own:
+                conn.commit()
+        total, planner = (s["message_count"], s["planner_messages"]) if s else (0, 0)
+        self.count_by_sender = {"customer": total - planner, "planner": planner}
+        self.last_id = self.messages[-1]["id"] if self.messages else 0
+        self.loaded = True
+
+    def refresh(self, conn) -> list:
+        if not self.loaded:
+            self._initial_load(conn)
+            return list(self.messages)
+        self.seen_version = CHANGES.version(self.thread_id)
+        self.checked_at = time.monotonic()
+        new = [dict(r) for r in get_messages_after(conn, self.thread_id, self.last_id)]
+        for m in new:
+            self.count_by_sender[m["sender"]] = self.count_by_sender.get(m["sender"], 0) + 1
+        if new:
+            self.messages.extend(new)
+            self.last_id = new[-1]["id"]
+        return new
+
+def thread_messages(cache: dict, conn, thread_id: int) -> ThreadMessages:
+    """ThreadMessages aus `cache` (z. B. st.session_state-Dict) holen; die DB wird
+    nur abgefragt, wenn der Änderungs-Feed eine neue Version meldet."""
+    tm = cache.get(thread_id)
+    if tm is None:
+        tm = cache[thread_id] = ThreadMessages(thread_id)
+    if tm.stale():
+        tm.refresh(conn)
+    return tm
+
+SQL_APPLY_RATING = """
+    UPDATE planners
+    SET score = score + ?1, level = level_from_score(score + ?1)
+    WHERE id = (SELECT planner_id FROM threads WHERE id = ?2)
+    RETURNING id, score, level
+"""
+
+def rate_thread(conn, thread_id: int, rating: int, feedback: str) -> Optional[dict]:
+    """Bewertung speichern und Score/Level des Beraters in einer Transaktion fortschreiben.
+
+    Liefert {"planner_id", "score", "level"}, {} ohne zugeordneten Berater
+    oder None, wenn der Thread schon bewertet ist oder nicht (mehr) existiert
+    (z. B. archiviert). Braucht eine Verbindung ohne offene Transaktion.
+    """
+    if conn.in_transaction:
+        # BEGIN IMMEDIATE würde sonst die Transaktion des Aufrufers stillschweigend committen
+        raise sqlite3.ProgrammingError("rate_thread: Verbindung hat eine offene Transaktion")
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # Nur für existierende Threads: sonst bliebe eine verwaiste Bewertung zurück
+        cur = conn.execute("INSERT INTO ratings(thread_id, score, feedback, created_at) "
+                           "SELECT id, ?, ?, ? FROM threads WHERE id=?", (rating, feedback, now_iso(), thread_id))
+        if not cur.rowcount:
+            conn.rollback()
+            return None
+        row = conn.execute(SQL_APPLY_RATING, (score_delta_for_rating(rating), thread_id)).fetchone()
+        conn.commit()
+    except sqlite3.IntegrityError:
+        conn.rollback()
+        return None
+    except Exception:
+        conn.rollback()
+        raise
+    CHANGES.publish(thread_id)
+    if not row:
+        return {}
+    PRESENCE.update_score(row[0], row[1], row[2])
+    return {"planner_id": row[0], "score": row[1], "level": row[2]}
+
+def _rate_thread_legacy(conn, thread_id: int, rating: int, feedback: str):
+    """Bisherige Variante (mehrere Commits/Round-Trips) – nur als Benchmark-Baseline."""
+    cur = conn.cursor()
+    try:
+        cur.execute("INSERT INTO ratings(thread_id, score, feedback, created_at) VALUES (?,?,?,?)",
+                    (thread_id, rating, feedback, now_iso()))
+        conn.commit()
+        cur.execute("SELECT planner_id FROM threads WHERE id=?", (thread_id,))
+        row = cur.fetchone()
+        if row:
+            planner_id = row["planner_id"]
+            cur.execute("UPDATE planners SET score = score + ? WHERE id=?", (score_delta_for_rating(rating), planner_id))
+            cur.execute("UPDATE planners SET level = ? WHERE id=?", (level_from_score(get_planner_score(conn, planner_id)), planner_id))
+            conn.commit()
+    except sqlite3.IntegrityError:
+        pass
+
+def get_planner_score(conn, planner_id: int) -> int:
+    cur = conn.cursor()
+    cur.execute("SELECT score FROM planners WHERE id=?", (planner_id,))
+    r = cur.fetchone()
+    return r["score"] if r else 0
+
+
+# ---- Payment & Satisfaction Helpers (0.2.7) ----
+def ensure_thread_payment_columns(conn):
+    # Kompatibilität: die Spalten kommen jetzt aus Migration 2 (siehe MIGRATIONS)
+    init_db(conn)
+
+def _update_thread_paid(conn, thread_id: int, flag: int) -> Optional[int]:
+    row = conn.execute("UPDATE threads SET paid=? WHERE id=? RETURNING planner_id",
+                       (int(bool(flag)), thread_id)).fetchone()
+    return row[0] if row else None
+
+def _thread_changed(thread_id: int, planner_id: Optional[int]) -> None:
+    CHANGES.publish(thread_id)
+    if planner_id is not None:
+        SCHEDULER.invalidate(planner_id)
+
+def set_thread_paid(conn, thread_id: int, flag: int):
+    planner_id = _update_thread_paid(conn, thread_id, flag)
+    conn.commit()
+    _thread_changed(thread_id, planner_id)
+
+def set_thread_paid_buffered(thread_id: int, flag: int, path: Optional[str] = None) -> Future:
+    """Wie set_thread_paid, über den Group-Commit-Writer."""
+    return get_writer(path).submit(_update_thread_paid, thread_id, flag,
+                                   on_commit=lambda pid: _thread_changed(thread_id, pid))
+
+def set_thread_released(conn, thread_id: int, flag: int):
+    cur = conn.cursor()
+    cur.execute("UPDATE threads SET released=? WHERE id=?", (int(bool(flag)), thread_id))
+    conn.commit()
+    CHANGES.publish(thread_id)
+
+def set_thread_status(conn, thread_id: int, status: str):
+    cur = conn.cursor()
+    cur.execute("UPDATE threads SET status=? WHERE id=? RETURNING planner_id", (status, thread_id))
+    row = cur.fetchone()
+    conn.commit()
+    CHANGES.publish(thread_id)
+    if row:
+        SCHEDULER.invalidate(row[0])
+
+def get_thread_summary(conn, thread_id: int) -> Optional[dict]:
+    """thread_summary-Zeile oder None, wenn der Thread nicht (mehr) im Live-DB ist."""
+    r = conn.execute(SQL_THREAD_SUMMARY, (thread_id,)).fetchone()
+    return dict(r) if r else None
+
+def get_thread_state(conn, thread_id: int):
+    """Gate-Zustand aus thread_summary (ein Zugriff über den Primärschlüssel)."""
+    r = get_thread_summary(conn, thread_id)
+    if r:
+        return r
+    return {"id": thread_id, "paid": 0, "released": 0, "status": "open", "message_count": 0,
+            "has_planner_reply": 0, "planner_messages": 0, "last_message_ts": None, "rating": None,
+            "anon_id": None, "handle": None}
+# ---- End Payment Helpers ----
+
+# ---------- Benchmark: parallele Schreiber ----------
+def _bench_writers(path: str, pragmas: dict, writers: int, per_writer: int) -> dict:
+    for suffix in ("", "-wal", "-shm"):
+        try:
+            os.remove(path + suffix)
+        except OSError:
+            pass
+    pool = ConnectionPool(path, pragmas=pragmas)
+    with pool.connection() as conn:
+        conn.execute("CREATE TABLE messages (id INTEGER PRIMARY KEY AUTOINCREMENT, thread_id INTEGER, sender TEXT, content TEXT, ts TEXT)")
+        conn.commit()
+    errors = [0]
+    err_lock = threading.Lock()
+
+    def writer(n: int) -> None:
+        try:
+            conn = pool.acquire()
+        except sqlite3.OperationalError:
+            with err_lock:
+                errors[0] += per_writer
+            return
+        try:
+            for i in range(per_writer):
+                try:
+                    conn.execute("INSERT INTO messages(thread_id, sender, content, ts) VALUES (?,?,?,?)",
+                                 (n, "customer", f"Nachricht {i}", now_iso()))
+                    conn.commit()
+                    # Leser parallel zum Schreiben (wie die Chat-Reruns)
+                    conn.execute("SELECT COUNT(*) FROM messages WHERE thread_id=?", (n,)).fetchone()
+                except sqlite3.OperationalError:
+                    with err_lock:
+                        errors[0] += 1
+                    conn.rollback()
+        finally:
+            pool.release(conn)
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(writers)]
+    t0 = time.perf_counter()
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+    dt = time.perf_counter() - t0
+    with pool.connection() as conn:
+        rows = conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+    pool.close_all()
+    return {"rows": rows, "errors": errors[0], "seconds": dt, "rows_per_s": rows / dt if dt else 0.0}
+
+def _bench_group_commit(path: str, pragmas: dict, writers: int, per_writer: int, grouped: bool) -> dict:
+    """add_message mit Commit pro Nachricht vs. über den Group-Commit-Writer (Latenz bis Ack)."""
+    for suffix in ("", "-wal", "-shm"):
+        try:
+            os.remove(path + suffix)
+        except OSError:
+            pass
+    pool = ConnectionPool(path, pragmas=pragmas)
+    with pool.connection() as conn:
+        init_db(conn)
+    gc = GroupCommitWriter(pool) if grouped else None
+    lat: list = []
+    lat_lock = threading.Lock()
+
+    def writer(n: int) -> None:
+        mine = []
+        with pool.connection() as conn:
+            for i in range(per_writer):
+                t0 = time.perf_counter()
+                if gc:
+                    gc.submit(_insert_message, n, "customer", f"Nachricht {i}").result()
+                else:
+                    add_message(conn, n, "customer", f"Nachricht {i}")
+                mine.append(time.perf_counter() - t0)
+        with lat_lock:
+            lat.extend(mine)
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(writers)]
+    t0 = time.perf_counter()
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+    dt = time.perf_counter() - t0
+    stats = gc.stats() if gc else {}
+    if gc:
+        gc.close()
+    with pool.connection() as conn:
+        rows = conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+    pool.close_all()
+    lat.sort()
+    return {"rows": rows, "seconds": dt, "rows_per_s": rows / dt if dt else 0.0,
+            "p95_ms": 1000 * lat[int(0.95 * (len(lat) - 1))] if lat else 0.0,
+            "avg_batch": stats.get("avg_batch", 1.0)}
+
+SQL_AUDIT_SCORES = """
+    SELECT COUNT(*) FROM planners p
+    WHERE p.score != (SELECT COALESCE(SUM(score_delta(r.score)), 0)
+                      FROM ratings r JOIN threads t ON t.id = r.thread_id WHERE t.planner_id = p.id)
+"""
+
+def _bench_ratings(path: str, rate_fn, raters: int, per_rater: int, planners: int = 4) -> dict:
+    """Parallele Bewertungen auf wenige Berater; prüft Score und Level gegen den Soll-Wert.
+
+    Ein Prüf-Thread liest währenddessen Bewertungen und Scores im selben Snapshot:
+    passt die Summe der Bewertungen nicht zum Score, hat ein Leser einen halben
+    Stand gesehen (Bewertung committet, Score noch nicht). Die Endwerte stimmen
+    bei beiden Varianten, weil SQLite die Score-Updates serialisiert.
+    """
+    for suffix in ("", "-wal", "-shm"):
+        try:
+            os.remove(path + suffix)
+        except OSError:
+            pass
+    pool = ConnectionPool(path)
+    total = raters * per_rater
+    with pool.connection() as conn:
+        migrate(conn)
+        conn.executemany("INSERT INTO planners(hashed_member, assoc, handle, created_at) VALUES (?,?,?,?)",
+                         [(f"h{i}", "bench", f"p{i}", now_iso()) for i in range(planners)])
+        conn.execute("INSERT INTO customers(anon_id, created_at) VALUES ('bench', ?)", (now_iso(),))
+        conn.executemany("INSERT INTO threads(customer_id, planner_id, status, created_at) VALUES (1, ?, 'open', ?)",
+                         [(1 + i % planners, now_iso()) for i in range(total)])
+        conn.commit()
+    ratings = [1 + (i * 7) % 5 for i in range(total)]
+    expected = {}
+    for i, r in enumerate(ratings):
+        pid = 1 + i % planners
+        expected[pid] = expected.get(pid, 0) + score_delta_for_rating(r)
+    errors = [0]
+    err_lock = threading.Lock()
+    audits = [0, 0]  # [Lesungen, davon inkonsistent]
+    stop = threading.Event()
+
+    def auditor() -> None:
+        conn = pool.acquire()
+        conn.create_function("score_delta", 1, score_delta_for_rating, deterministic=True)
+        try:
+            while not stop.is_set():
+                conn.execute("BEGIN")
+                try:
+                    bad = conn.execute(SQL_AUDIT_SCORES).fetchone()[0]
+                finally:
+                    conn.commit()
+                audits[0] += 1
+                audits[1] += bool(bad)
+                time.sleep(0.001)
+        finally:
+            pool.release(conn)
+
+    def rater(n: int) -> None:
+        conn = pool.acquire()
+        try:
+            for i in range(n * per_rater, (n + 1) * per_rater):
+                try:
+                    rate_fn(conn, i + 1, ratings[i], "")
+                except sqlite3.OperationalError:
+                    with err_lock:
+                        errors[0] += 1
+                    conn.rollback()
+        finally:
+            pool.release(conn)
+
+    threads = [threading.Thread(target=rater, args=(n,)) for n in range(raters)]
+    audit = threading.Thread(target=auditor)
+    audit.start()
+    t0 = time.perf_counter()
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+    dt = time.perf_counter() - t0
+    stop.set()
+    audit.join()
+    with pool.connection() as conn:
+        rows = conn.execute("SELECT id, score, level FROM planners").fetchall()
+        rated = conn.execute("SELECT COUNT(*) FROM ratings").fetchone()[0]
+    pool.close_all()
+    wrong_score = sum(1 for r in rows if r["score"] != expected.get(r["id"], 0))
+    wrong_level = sum(1 for r in rows if r["level"] != level_from_score(r["score"]))
+    return {"ratings": rated, "seconds": dt, "per_s": rated / dt if dt else 0.0, "errors": errors[0],
+            "wrong_score": wrong_score, "wrong_level": wrong_level, "audits": audits[0], "torn_reads": audits[1]}
+
+# ---------- Benchmark: Volltextsuche ----------
+_WORDS = ("säule", "3a", "pensionskasse", "einkauf", "steuer", "hypothek", "amortisation", "vorbezug",
+          "ahv", "lücke", "rente", "kapital", "bezug", "etf", "depot", "budget", "zins", "miete",
+          "franken", "freizügigkeit", "konto", "splitting", "frühpensionierung", "erbschaft")
+
+def _bench_search(path: str, n: int, planners: int = 50, per_thread: int = 40, seed: int = 7) -> None:
+    """Synthetischer Korpus mit n Nachrichten; LIKE-Scan vs. FTS5 (gesamt und pro Berater)."""
+    import random
+    rng = random.Random(seed)
+    for suffix in ("", "-wal", "-shm"):
+        try:
+            os.remove(path + suffix)
+        except OSError:
+            pass
+    pool = ConnectionPool(path)
+    with pool.connection() as conn:
+        migrate(conn)
+        conn.executemany("INSERT INTO planners(hashed_member, assoc, handle, created_at) VALUES (?,?,?,?)",
+                         [(f"h{i}", "bench", f"p{i}", now_iso()) for i in range(planners)])
+        conn.execute("INSERT INTO customers(anon_id, created_at) VALUES ('bench', ?)", (now_iso(),))
+        n_threads = max(n // per_thread, 1)
+        conn.executemany("INSERT INTO threads(customer_id, planner_id, status, created_at) VALUES (1, ?, 'open', ?)",
+                         [(1 + i % planners, now_iso()) for i in range(n_threads)])
+        conn.commit()
+        # Zipf-artiges Vokabular: wenige häufige Fachwörter, lange Liste seltener Wörter
+        vocab = list(_WORDS) + [f"wort{i}" for i in range(50_000)]
+        cum, acc = [], 0.0
+        for i in range(len(vocab)):
+            acc += 1.0 / (i + 1)
+            cum.append(acc)
+        t0 = time.perf_counter()
+        batch = 20_000
+        for start in range(0, n, batch):
+            rows = [(1 + i // per_thread, "planner" if i % 2 else "customer",
+                     " ".join(rng.choices(vocab, cum_weights=cum, k=12)), "2025-01-01T00:00:00+00:00")
+                    for i in range(start, min(start + batch, n))]
+            conn.executemany("INSERT INTO messages(thread_id, sender, content, ts) VALUES (?,?,?,?)", rows)
+            conn.commit()
+        print(f"Korpus: {n:,} Nachrichten in {time.perf_counter() - t0:.1f} s (inkl. FTS-Trigger)".replace(",", "'"))
+
+        def timed(fn, reps: int = 3) -> tuple:
+            best, res = float("inf"), None
+            for _ in range(reps):
+                t1 = time.perf_counter()
+                res = fn()
+                best = min(best, time.perf_counter() - t1)
+            return best * 1000, res
+
+        like_all = ("SELECT m.id FROM messages m WHERE m.content LIKE ? ORDER BY m.id DESC LIMIT ?")
+        like_planner = ("SELECT m.id FROM messages m JOIN threads t ON t.id = m.thread_id "
+                        "WHERE t.planner_id = ? AND m.content LIKE ? ORDER BY m.id DESC LIMIT ?")
+        print("LIKE = neueste 20 ohne Ranking (bricht früh ab), FTS = 20 relevanteste (bm25)")
+        for word in ("steuer", "wort150", "wort40000"):  # häufig / mittel / selten
+            ms_la, _ = timed(lambda: conn.execute(like_all, (f"%{word}%", SEARCH_PAGE_SIZE)).fetchall())
+            ms_fa, _ = timed(lambda: search_messages(conn, word))
+            ms_lp, _ = timed(lambda: conn.execute(like_planner, (7, f"%{word}%", SEARCH_PAGE_SIZE)).fetchall())
+            ms_fp, _ = timed(lambda: search_messages(conn, word, planner_id=7))
+            hits = conn.execute("SELECT COUNT(*) FROM messages_fts WHERE messages_fts MATCH ?",
+                                (fts_query(word),)).fetchone()[0]
+            print(f"{word:10} {hits:8d} Treffer  gesamt: LIKE {ms_la:8.1f} ms  FTS {ms_fa:8.1f} ms   "
+                  f"Berater: LIKE {ms_lp:8.1f} ms  FTS {ms_fp:8.1f} ms")
+    pool.close_all()
+
+# ---------- Simulation: Auto-Zuweisung ----------
+def _simulate_assignment(policy: str, planners: int = 8, threads: int = 5000,
+                         arrivals_per_h: float = 60.0, service_min: float = 6.0, seed: int = 7) -> dict:
+    """Ereignis-Simulation: Threads treffen Poisson-verteilt ein, jede:r Berater:in
+    bearbeitet die eigene Warteschlange nacheinander (Bearbeitungszeit exponentiell).
+
+    policy "score": immer höchster Score (bisherige Auto-Zuweisung);
+    policy "load":  AssignmentScheduler. Liefert Wartezeiten in Minuten.
+    """
+    import random
+    rng = random.Random(seed)
+    sched = AssignmentScheduler()
+    scores = {pid: 200 - 20 * pid for pid in range(planners)}
+    for pid, score in scores.items():
+        sched.join(pid, score, paid=0, unpaid=0)
+    free_at = {pid: 0.0 for pid in scores}
+    done: list = []              # Heap [(ende, id)] für Lastabbau
+    waits, per_planner = [], {pid: 0 for pid in scores}
+    now = 0.0
+    for _ in range(threads):
+        now += rng.expovariate(arrivals_per_h / 60.0)
+        while done and done[0][0] <= now:
+            _, pid = heapq.heappop(done)
+            sched.adjust(pid, paid=-1)
+        pid = max(scores, key=scores.get) if policy == "score" else sched.pick()
+        start = max(now, free_at[pid])
+        free_at[pid] = start + rng.expovariate(1.0 / service_min)
+        heapq.heappush(done, (free_at[pid], pid))
+        sched.adjust(pid, paid=1)
+        waits.append(start - now)
+        per_planner[pid] += 1
+    waits.sort()
+    return {"mean": sum(waits) / len(waits), "p95": waits[int(0.95 * (len(waits) - 1))],
+            "max": waits[-1], "busiest_share": max(per_planner.values()) / threads}
+
+if __name__ == "__main__":
+    import argparse
+    import tempfile
+    ap = argparse.ArgumentParser(description="FINAURA Chat DB – Schreib-Benchmark (Rollback-Journal vs. WAL)")
+    ap.add_argument("--writers", type=int, default=8)
+    ap.add_argument("--messages", type=int, default=300, help="Nachrichten pro Schreiber")
+    ap.add_argument("--ratings", type=int, nargs="?", const=200,
+                    help="Bewertungs-Benchmark: Bewertungen pro Schreiber (alt vs. eine Transaktion)")
+    ap.add_argument("--simulate", type=int, nargs="?", const=5000,
+                    help="Auto-Zuweisung simulieren: Anzahl Threads (höchster Score vs. geringste Last)")
+    ap.add_argument("--search", type=int, nargs="?", const=1_000_000,
+                    help="Volltext-Benchmark: Anzahl synthetischer Nachrichten (LIKE vs. FTS5)")
+    ap.add_argument("--group-commit", action="store_true",
+                    help="Commit pro Nachricht vs. Group Commit (synchronous NORMAL und FULL)")
+    ap.add_argument("--planners", type=int, default=8)
+    ap.add_argument("--per-hour", type=float, default=60.0, help="Neue Threads pro Stunde")
+    ap.add_argument("--check-plans", action="store_true",
+                    help="EXPLAIN QUERY PLAN der Hot Queries prüfen (Exit-Code 1 bei Tabellen-Scan)")
+    args = ap.parse_args()
+    if args.check_plans:
+        import sys
+        with tempfile.TemporaryDirectory() as td:
+            pool = get_pool(os.path.join(td, "plans.db"))
+            with pool.connection() as conn:
+                init_db(conn)
+                bad = check_query_plans(conn)
+            pool.close_all()
+        for name, plan in bad.items():
+            print(f"FAIL {name}: " + " | ".join(plan))
+        print("OK – alle Hot Queries nutzen Indizes." if not bad else f"{len(bad)} Query(s) mit Scan.")
+        sys.exit(1 if bad else 0)
+    if args.group_commit:
+        with tempfile.TemporaryDirectory() as td:
+            for sync in ("NORMAL", "FULL"):
+                pragmas = dict(SQLITE_PRAGMAS, synchronous=sync)
+                for label, grouped in (("Commit pro Nachricht", False), ("Group Commit", True)):
+                    r = _bench_group_commit(os.path.join(td, "gc.db"), pragmas, args.writers, args.messages, grouped)
+                    print(f"{sync:6} {label:22} {r['rows']:6d} Zeilen  {r['seconds']:7.2f} s  "
+                          f"{r['rows_per_s']:8.0f} Zeilen/s  p95 Ack {r['p95_ms']:7.2f} ms  "
+                          f"Ø Batch {r['avg_batch']:6.1f}")
+        raise SystemExit(0)
+    if args.search:
+        with tempfile.TemporaryDirectory() as td:
+            _bench_search(os.path.join(td, "search.db"), args.search)
+        raise SystemExit(0)
+    if args.simulate:
+        for label, policy in (("Höchster Score (alt)", "score"), ("Geringste Last", "load")):
+            r = _simulate_assignment(policy, args.planners, args.simulate, args.per_hour)
+            print(f"{label:22} Wartezeit Ø {r['mean']:9.1f} min  p95 {r['p95']:9.1f} min  "
+                  f"max {r['max']:9.1f} min  Anteil meistbelastete:r {r['busiest_share']:5.1%}")
+        raise SystemExit(0)
+    if args.ratings:
+        with tempfile.TemporaryDirectory() as td:
+            path = os.path.join(td, "ratings.db")
+            for label, fn in (("Mehrere Commits (alt)", _rate_thread_legacy), ("Eine Transaktion", rate_thread)):
+                r = _bench_ratings(path, fn, args.writers, args.ratings)
+                print(f"{label:24} {r['ratings']:6d} Bewertungen  {r['seconds']:7.2f} s  {r['per_s']:8.0f}/s  "
+                      f"locked: {r['errors']}  Score falsch: {r['wrong_score']}  Level falsch: {r['wrong_level']}  "
+                      f"halber Stand gelesen: {r['torn_reads']}/{r['audits']}")
+        raise SystemExit(0)
+    with tempfile.TemporaryDirectory() as td:
+        path = os.path.join(td, "bench.db")
+        legacy = {"journal_mode": "DELETE", "synchronous": "FULL"}
+        for label, pragmas in (("Rollback-Journal (alt)", legacy), ("WAL + Pragmas", SQLITE_PRAGMAS)):
+            r = _bench_writers(path, pragmas, args.writers, args.messages)
+            print(f"{label:24} {r['rows']:6d} Zeilen  {r['seconds']:7.2f} s  "
+                  f"{r['rows_per_s']:8.0f} Zeilen/s  locked-Fehler: {r['errors']}")
+
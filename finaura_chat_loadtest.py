@@ -0,0 +1,266 @@
+"""
+FINAURA Chat – Lasttest
+-----------------------
+
+Install (once):
+    nothing beyond the standard library (uses finaura_chat_db)
+
+Run (example):
+    python finaura_chat_loadtest.py --customers 500 --planners 50 --concurrency 64 --report loadtest.json
+    python finaura_chat_loadtest.py --from-db finaura_chat.db        # on a copy of the real DB
+
+Reproducible load generator for the chat data layer. Every customer runs
+a full session (register, login, create thread, pay, message burst, wait
+for the planner reply, release, rate); planners log in, send heartbeats
+and answer open threads. Each session has its own seeded RNG, so the same
+--seed gives the same workload. Latency per operation (p50/p95/p99),
+lock errors and throughput go to a JSON report.
+
+The database is always a temporary file (--from-db copies the source
+first); the original is never written.
+"""
+
+from __future__ import annotations
+import json
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import finaura_chat_db as chat_db
+
+class SessionFailed(Exception):
+    pass
+
+class Recorder:
+    """Latenzen und Fehler je Operation, threadsicher gesammelt."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples: dict = {}   # op -> [sekunden]
+        self.errors: dict = {}    # op -> {art: anzahl}
+
+    def call(self, op: str, fn, *args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            result = fn(*args, **kwargs)
+        except sqlite3.OperationalError as e:
+            msg = str(e).lower()
+            self.error(op, "locked" if "locked" in msg or "busy" in msg else "operational")
+            raise SessionFailed(op) from e
+        except sqlite3.Error as e:
+            self.error(op, type(e).__name__)
+            raise SessionFailed(op) from e
+        self.record(op, time.perf_counter() - t0)
+        return result
+
+    def record(self, op: str, seconds: float) -> None:
+        with self._lock:
+            self.samples.setdefault(op, []).append(seconds)
+
+    def error(self, op: str, kind: str) -> None:
+        with self._lock:
+            errs = self.errors.setdefault(op, {})
+            errs[kind] = errs.get(kind, 0) + 1
+
+    def summary(self) -> dict:
+        out = {}
+        with self._lock:
+            for op in sorted(set(self.samples) | set(self.errors)):
+                xs = sorted(self.samples.get(op, []))
+                errs = self.errors.get(op, {})
+                out[op] = {
+                    "count": len(xs),
+                    "errors": dict(errs),
+                    "mean_ms": 1000 * sum(xs) / len(xs) if xs else None,
+                    "p50_ms": _pct(xs, 50),
+                    "p95_ms": _pct(xs, 95),
+                    "p99_ms": _pct(xs, 99),
+                    "max_ms": 1000 * xs[-1] if xs else None,
+                }
+        return out
+
+def _pct(sorted_xs: list, p: float) -> Optional[float]:
+    if not sorted_xs:
+        return None
+    k = max(0, min(len(sorted_xs) - 1, int(round(p / 100 * len(sorted_xs) + 0.5)) - 1))
+    return 1000 * sorted_xs[k]
+
+# ---------- Sitzungen ----------
+def _think(rng: random.Random, ms: float) -> None:
+    if ms > 0:
+        time.sleep(rng.uniform(0.5, 1.5) * ms / 1000)
+
+def customer_session(pool, rec: Recorder, idx: int, cfg: dict) -> bool:
+    rng = random.Random(cfg["seed"] * 100_003 + idx)
+    conn = pool.thread_connection()
+    try:
+        cid = rec.call("register", chat_db.ensure_customer, conn, f"lt-{cfg['seed']}-{idx}")
+        rec.call("login", chat_db.get_user_threads, conn, "customer", cid)
+        rec.call("list_online", chat_db.list_online_planners, conn)
+        pid = rec.call("pick_planner", chat_db.pick_planner, conn, "")
+        if pid is None:
+            raise SessionFailed("pick_planner")
+        tid = rec.call("create_thread", chat_db.create_thread, conn, cid, pid)
+        rec.call("pay", chat_db.set_thread_paid, conn, tid, 1)
+        cache: dict = {}
+        for i in range(rng.randint(1, cfg["burst"])):
+            _think(rng, cfg["think_ms"])
+            rec.call("add_message", chat_db.add_message, conn, tid, "customer",
+                     f"Frage {i}: " + " ".join(rng.choices(_TOPICS, k=8)))
+            rec.call("read_messages", chat_db.thread_messages, cache, conn, tid)
+        # Auf die Antwort warten (Änderungs-Feed, wie die Live-Ansicht)
+        deadline = time.monotonic() + cfg["reply_timeout_s"]
+        t0 = time.perf_counter()
+        tm = chat_db.thread_messages(cache, conn, tid)
+        while not tm.has_planner and time.monotonic() < deadline:
+            seen = chat_db.CHANGES.version(tid)
+            chat_db.CHANGES.wait(tid, seen, timeout=max(0.0, deadline - time.monotonic()))
+            tm = rec.call("read_messages", chat_db.thread_messages, cache, conn, tid)
+        if tm.has_planner:
+            rec.record("reply_wait", time.perf_counter() - t0)
+        else:
+            rec.error("reply_wait", "timeout")
+        _think(rng, cfg["think_ms"])
+        rec.call("release", chat_db.set_thread_released, conn, tid, 1)
+        rec.call("close", chat_db.set_thread_status, conn, tid, "closed")
+        rec.call("rate", chat_db.rate_thread, conn, tid, rng.choice([3, 4, 4, 5, 5, 5]), "")
+        return True
+    except SessionFailed:
+        conn.rollback()
+        return False
+
+def planner_agent(pool, rec: Recorder, idx: int, cfg: dict, stop: threading.Event) -> None:
+    rng = random.Random(cfg["seed"] * 7_919 + idx)
+    conn = pool.thread_connection()
+    h = chat_db.salted_hash(f"lt-{cfg['seed']}-{idx}", "loadtest")
+    try:
+        row = rec.call("planner_login", chat_db.get_planner_by_hash, conn, h)
+        if row is None:
+            rec.call("planner_register", chat_db.upsert_planner, conn, h, "loadtest", f"lt{idx}")
+            row = rec.call("planner_login", chat_db.get_planner_by_hash, conn, h)
+        pid = row["id"]
+        rec.call("planner_online", chat_db.set_planner_online, conn, pid, True)
+    except SessionFailed:
+        return
+    seen: dict = {}
+    next_beat = 0.0
+    while not stop.is_set():
+        try:
+            if time.monotonic() >= next_beat:
+                rec.call("heartbeat", chat_db.planner_heartbeat, conn, pid)
+                next_beat = time.monotonic() + cfg["heartbeat_s"]
+            threads = rec.call("planner_threads", chat_db.get_user_threads, conn, "planner", pid)
+            for t in threads:
+                if t["status"] == "closed":
+                    continue
+                new = rec.call("planner_poll", chat_db.get_messages_after, conn, t["id"], seen.get(t["id"], 0))
+                if new:
+                    seen[t["id"]] = new[-1]["id"]
+                    if new[-1]["sender"] == "customer":
+                        _think(rng, cfg["think_ms"])
+                        rec.call("planner_reply", chat_db.add_message, conn, t["id"], "planner",
+                                 "Antwort: " + " ".join(rng.choices(_TOPICS, k=12)))
+        except SessionFailed:
+            conn.rollback()
+        stop.wait(cfg["planner_poll_ms"] / 1000)
+    try:
+        chat_db.set_planner_online(conn, pid, False)
+    except sqlite3.Error:
+        pass
+
+_TOPICS = ("Säule 3a", "Pensionskasse", "Einkauf", "Steuern", "Hypothek", "AHV", "Vorbezug", "Rente",
+           "Kapitalbezug", "ETF", "Budget", "Freizügigkeit", "Amortisation", "Frühpensionierung")
+
+# ---------- Ablauf ----------
+def _in_scope(pool, fn, *args):
+    # Verbindung am Ende der Sitzung zurückgeben, nicht erst wenn der Executor-Thread endet
+    with pool.thread_scope():
+        return fn(pool, *args)
+
+def run(cfg: dict) -> dict:
+    td = tempfile.mkdtemp(prefix="finaura-loadtest-")
+    path = os.path.join(td, "loadtest.db")
+    if cfg.get("from_db"):
+        src = sqlite3.connect(f"file:{cfg['from_db']}?mode=ro", uri=True)
+        dst = sqlite3.connect(path)
+        src.backup(dst)
+        src.close()
+        dst.close()
+    pool = chat_db.get_pool(path)
+    with pool.connection() as conn:
+        chat_db.migrate(conn)
+    rec = Recorder()
+    stop = threading.Event()
+    planners = [threading.Thread(target=_in_scope, args=(pool, planner_agent, rec, i, cfg, stop), daemon=True)
+                for i in range(cfg["planners"])]
+    for th in planners:
+        th.start()
+    time.sleep(0.2)  # Berater melden sich an, bevor die ersten Kund:innen zuweisen
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=cfg["concurrency"]) as ex:
+        results = list(ex.map(lambda i: _in_scope(pool, customer_session, rec, i, cfg), range(cfg["customers"])))
+    wall = time.perf_counter() - t0
+    stop.set()
+    for th in planners:
+        th.join()
+    ops = rec.summary()
+    total_ops = sum(o["count"] for o in ops.values())
+    lock_errors = sum(o["errors"].get("locked", 0) for o in ops.values())
+    report = {
+        "config": {k: v for k, v in cfg.items()},
+        "sqlite_version": sqlite3.sqlite_version,
+        "pragmas": pool.pragmas,
+        "wall_s": wall,
+        "sessions": {"ok": sum(results), "failed": len(results) - sum(results)},
+        "ops_total": total_ops,
+        "ops_per_s": total_ops / wall if wall else 0.0,
+        "lock_errors": lock_errors,
+        "pool": pool.stats(),
+        "operations": ops,
+    }
+    pool.close_all()
+    shutil.rmtree(td, ignore_errors=True)
+    return report
+
+def _print_report(r: dict) -> None:
+    print(f"Sitzungen ok/fehlgeschlagen: {r['sessions']['ok']}/{r['sessions']['failed']}  "
+          f"Dauer {r['wall_s']:.1f} s  {r['ops_total']} Ops ({r['ops_per_s']:.0f}/s)  "
+          f"locked-Fehler: {r['lock_errors']}")
+    print(f"{'Operation':18} {'n':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}  Fehler")
+    fmt = lambda v: f"{v:9.2f}" if v is not None else f"{'–':>9}"
+    for op, o in r["operations"].items():
+        print(f"{op:18} {o['count']:7d} {fmt(o['p50_ms'])} {fmt(o['p95_ms'])} {fmt(o['p99_ms'])} "
+              f"{fmt(o['max_ms'])}  {o['errors'] or ''}")
+
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="FINAURA Chat – Lasttest")
+    ap.add_argument("--customers", type=int, default=500)
+    ap.add_argument("--planners", type=int, default=50)
+    ap.add_argument("--concurrency", type=int, default=64, help="Gleichzeitige Kund:innen-Sitzungen")
+    ap.add_argument("--burst", type=int, default=5, help="Max. Nachrichten pro Sitzung")
+    ap.add_argument("--think-ms", type=float, default=20.0, help="Mittlere Denkpause zwischen Aktionen")
+    ap.add_argument("--planner-poll-ms", type=float, default=200.0)
+    ap.add_argument("--heartbeat-s", type=float, default=chat_db.PRESENCE_HEARTBEAT_S)
+    ap.add_argument("--reply-timeout-s", type=float, default=30.0)
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--from-db", default=None, help="Bestehende DB als Ausgangslage (wird kopiert)")
+    ap.add_argument("--report", default="loadtest_report.json", help="Pfad des JSON-Reports")
+    args = ap.parse_args()
+    cfg = {
+        "customers": args.customers, "planners": args.planners, "concurrency": args.concurrency,
+        "burst": args.burst, "think_ms": args.think_ms, "planner_poll_ms": args.planner_poll_ms,
+        "heartbeat_s": args.heartbeat_s, "reply_timeout_s": args.reply_timeout_s,
+        "seed": args.seed, "from_db": args.from_db,
+    }
+    report = run(cfg)
+    with open(args.report, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    _print_report(report)
+    print(f"Report: {args.report}")
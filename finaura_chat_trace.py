@@ -0,0 +1,344 @@
+"""
+FINAURA Chat – SQL-Tracing
+--------------------------
+
+Install (once):
+    nothing beyond the standard library
+
+Run (example):
+    FINAURA_SQL_METRICS=finaura_sql_metrics.json streamlit run finaura_chat_anon_v0_2_7.py
+    python finaura_chat_trace.py --show                 # Metrik-Datei als Tabelle
+    python finaura_chat_trace.py --bench 20000          # Overhead des Tracings
+
+Per-query timing for the chat data layer. ConnectionPool opens its
+connections with `TracedConnection`, whose cursors measure every statement
+from execute() until the last row is fetched (time spent by the caller
+between fetches is not counted). Statements are grouped by fingerprint
+(literals and IN lists collapsed, whitespace normalized); per fingerprint
+we keep count, total/max time, rows returned, calling function and a
+latency histogram with fixed buckets. Parameters are never recorded
+(messages contain personal data).
+
+The aggregate is shown in the hidden admin view of the chat app. With
+FINAURA_SQL_METRICS set it is also written to that JSON file by a
+background thread every FINAURA_SQL_METRICS_EVERY_S seconds and at exit
+(opt-in, so benchmarks and scripts leave no files behind; never on the
+query path).
+Statements slower than the threshold go to the `finaura.sql` logger as
+warnings.
+
+Settings:
+    FINAURA_SQL_TRACE          (default: 1 – 0 schaltet das Tracing ab)
+    FINAURA_SQL_SLOW_MS        (default: 100)
+    FINAURA_SQL_METRICS        (default: leer = keine Datei, z. B. finaura_sql_metrics.json)
+    FINAURA_SQL_METRICS_EVERY_S (default: 60)
+"""
+
+from __future__ import annotations
+import atexit
+import bisect
+import json
+import logging
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from functools import lru_cache
+from typing import Optional
+
+SQL_TRACE = os.getenv("FINAURA_SQL_TRACE", "1") != "0"
+SLOW_MS = float(os.getenv("FINAURA_SQL_SLOW_MS", "100"))
+METRICS_PATH = os.getenv("FINAURA_SQL_METRICS", "")
+METRICS_EVERY_S = float(os.getenv("FINAURA_SQL_METRICS_EVERY_S", "60"))
+
+# Obergrenzen der Histogramm-Buckets in ms (letzter Bucket: alles darüber)
+BUCKETS_MS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+log = logging.getLogger("finaura.sql")
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST_RE = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SPACE_RE = re.compile(r"\s+")
+
+@lru_cache(maxsize=2048)
+def fingerprint(sql: str) -> str:
+    """Normalisierte Form: Literale → ?, IN-Listen → (?,…), Whitespace zusammengefasst."""
+    s = _STRING_RE.sub("?", sql)
+    s = _NUMBER_RE.sub("?", s)
+    s = _IN_LIST_RE.sub("(?,…)", s)
+    return _SPACE_RE.sub(" ", s).strip()
+
+def _quantile(buckets: list, count: int, p: float) -> Optional[float]:
+    """Schätzung aus dem Histogramm: Obergrenze des Buckets, in dem das Quantil liegt."""
+    if not count:
+        return None
+    need = p / 100 * count
+    seen = 0
+    for i, n in enumerate(buckets):
+        seen += n
+        if seen >= need:
+            return BUCKETS_MS[i] if i < len(BUCKETS_MS) else float("inf")
+    return float("inf")
+
+class SqlMetrics:
+    """Prozessweite Aggregation je Fingerprint (threadsicher)."""
+
+    def __init__(self, path: Optional[str] = METRICS_PATH, slow_ms: float = SLOW_MS,
+                 every_s: float = METRICS_EVERY_S):
+        self.path = path
+        self.slow_ms = slow_ms
+        self.every_s = every_s
+        self._lock = threading.Lock()
+        self._queries: dict = {}
+        self._since = time.time()
+        self._dumper: Optional[threading.Thread] = None
+        self._dump_lock = threading.Lock()  # Hintergrund-Thread und atexit teilen sich die tmp-Datei
+
+    def record(self, sql: str, seconds: float, rows: int, caller: str) -> None:
+        fp = fingerprint(sql)
+        ms = seconds * 1000
+        with self._lock:
+            q = self._queries.get(fp)
+            if q is None:
+                q = self._queries[fp] = {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "rows": 0, "slow": 0,
+                                         "buckets": [0] * (len(BUCKETS_MS) + 1), "callers": {}}
+            q["count"] += 1
+            q["total_ms"] += ms
+            q["rows"] += rows
+            if ms > q["max_ms"]:
+                q["max_ms"] = ms
+            q["buckets"][bisect.bisect_left(BUCKETS_MS, ms)] += 1
+            q["callers"][caller] = q["callers"].get(caller, 0) + 1
+            if ms >= self.slow_ms:
+                q["slow"] += 1
+            start = self.path and self._dumper is None
+            if start:
+                self._dumper = threading.Thread(target=self._dump_loop, name="finaura-sql-metrics", daemon=True)
+        if start:
+            self._dumper.start()
+        if ms >= self.slow_ms:
+            log.warning("slow query %.1f ms, %d rows, %s: %s", ms, rows, caller, fp)
+
+    def _dump_loop(self) -> None:
+        # Datei-I/O im eigenen Thread, nicht im Request-Thread der gemessenen Query
+        while True:
+            time.sleep(self.every_s)
+            self.dump()
+
+    def snapshot(self) -> list:
+        """Eine Zeile pro Fingerprint, nach Gesamtzeit absteigend."""
+        with self._lock:
+            items = [(fp, dict(q, buckets=list(q["buckets"]), callers=dict(q["callers"])))
+                     for fp, q in self._queries.items()]
+        out = []
+        for fp, q in items:
+            n = q["count"]
+            pct = lambda p: min(_quantile(q["buckets"], n, p), q["max_ms"])  # Bucket-Grenze ≤ Maximum
+            out.append({
+                "sql": fp, "count": n, "total_ms": q["total_ms"], "mean_ms": q["total_ms"] / n,
+                "p50_ms": pct(50), "p95_ms": pct(95), "p99_ms": pct(99), "max_ms": q["max_ms"],
+                "rows": q["rows"], "rows_per_call": q["rows"] / n, "slow": q["slow"],
+                "callers": q["callers"], "buckets": q["buckets"],
+            })
+        out.sort(key=lambda r: r["total_ms"], reverse=True)
+        return out
+
+    def dump(self, path: Optional[str] = None) -> Optional[str]:
+        """Schreibt die Metriken atomar als JSON (tmp + rename)."""
+        path = path or self.path
+        if not path:
+            return None
+        data = {"since": self._since, "written_at": time.time(), "slow_ms": self.slow_ms,
+                "buckets_ms": list(BUCKETS_MS), "queries": self.snapshot()}
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with self._dump_lock:
+            try:
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(data, f, indent=1, ensure_ascii=False, default=str)
+                os.replace(tmp, path)
+            except OSError:
+                return None
+        return path
+
+    def reset(self) -> None:
+        with self._lock:
+            self._queries.clear()
+            self._since = time.time()
+
+METRICS = SqlMetrics()
+
+@atexit.register
+def _dump_at_exit() -> None:
+    with METRICS._lock:
+        empty = not METRICS._queries
+    if SQL_TRACE and not empty:
+        METRICS.dump()
+
+def _caller() -> str:
+    # Erster Frame ausserhalb dieses Moduls = aufrufender Helfer
+    f = sys._getframe(2)
+    while f is not None and f.f_code.co_filename == __file__:
+        f = f.f_back
+    if f is None:
+        return "?"
+    return f"{f.f_globals.get('__name__', '?')}.{f.f_code.co_name}"
+
+class TracedCursor(sqlite3.Cursor):
+    """Misst execute() + alle fetch*-Aufrufe eines Statements; abgeschlossen beim
+    letzten Fetch, beim nächsten execute(), bei close() oder beim Aufräumen."""
+
+    _pending = None  # [sql, caller, sekunden, zeilen]
+
+    def _finish(self) -> None:
+        p = self._pending
+        if p is not None:
+            self._pending = None
+            METRICS.record(p[0], p[2], p[3], p[1])
+
+    def _start(self, sql: str, run, *args):
+        self._finish()
+        caller = _caller()
+        t0 = time.perf_counter()
+        try:
+            run(*args)
+        finally:
+            self._pending = [sql, caller, time.perf_counter() - t0, 0]
+        if self.description is None:  # kein Ergebnis (INSERT/UPDATE/DDL)
+            self._pending[3] = max(self.rowcount, 0)
+            self._finish()
+        return self
+
+    def execute(self, sql, parameters=()):
+        return self._start(sql, super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self._start(sql, super().executemany, sql, seq_of_parameters)
+
+    def _fetched(self, t0: float, n: int, done: bool) -> None:
+        p = self._pending
+        if p is not None:
+            p[2] += time.perf_counter() - t0
+            p[3] += n
+            if done:
+                self._finish()
+
+    def fetchone(self):
+        t0 = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(t0, row is not None, row is None)
+        return row
+
+    def fetchmany(self, size=None):
+        t0 = time.perf_counter()
+        size = self.arraysize if size is None else size
+        rows = super().fetchmany(size)
+        self._fetched(t0, len(rows), len(rows) < size)
+        return rows
+
+    def fetchall(self):
+        t0 = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(t0, len(rows), True)
+        return rows
+
+    def __next__(self):
+        t0 = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._fetched(t0, 0, True)
+            raise
+        self._fetched(t0, 1, False)
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        self._finish()
+
+class TracedConnection(sqlite3.Connection):
+    """sqlite3.connect(..., factory=TracedConnection): alle Cursor werden gemessen."""
+
+    def cursor(self, factory=TracedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        if not self.in_transaction:
+            return super().commit()
+        caller = _caller()
+        t0 = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            METRICS.record("COMMIT", time.perf_counter() - t0, 0, caller)
+
+# ----------------- CLI -----------------
+def _ms(v: Optional[float]) -> str:
+    if v is None:
+        return f"{'–':>8}"
+    return f"{'>' + str(BUCKETS_MS[-1]):>8}" if v == float("inf") else f"{v:8.2f}"
+
+def print_table(rows: list, limit: int = 25) -> None:
+    fmt = _ms
+    print(f"{'n':>7} {'Σ ms':>9} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8} {'Zeilen':>7}  Query / Aufrufer")
+    for r in rows[:limit]:
+        top = max(r["callers"], key=r["callers"].get) if r["callers"] else "?"
+        print(f"{r['count']:7d} {r['total_ms']:9.1f} {fmt(r['p50_ms'])} {fmt(r['p95_ms'])} {fmt(r['p99_ms'])} "
+              f"{r['max_ms']:8.2f} {r['rows_per_call']:7.1f}  {r['sql'][:90]}  ← {top}")
+
+def _bench(n: int) -> None:
+    """Gleiche Lese-Queries mit und ohne TracedConnection."""
+    import tempfile
+    with tempfile.TemporaryDirectory() as td:
+        path = os.path.join(td, "trace.db")
+        setup = sqlite3.connect(path)
+        setup.execute("CREATE TABLE messages (id INTEGER PRIMARY KEY, thread_id INTEGER, content TEXT)")
+        setup.execute("CREATE INDEX idx_m ON messages(thread_id, id)")
+        setup.executemany("INSERT INTO messages(thread_id, content) VALUES (?, ?)",
+                          [(i % 500, f"Nachricht {i}") for i in range(50_000)])
+        setup.commit()
+        setup.close()
+        timings = {}
+        for label, factory in (("ohne Tracing", sqlite3.Connection), ("mit Tracing", TracedConnection)):
+            conn = sqlite3.connect(path, factory=factory)
+            conn.row_factory = sqlite3.Row
+            t0 = time.perf_counter()
+            for i in range(n):
+                conn.execute("SELECT id, content FROM messages WHERE thread_id=? AND id>? ORDER BY id LIMIT 20",
+                             (i % 500, i % 7)).fetchall()
+                conn.execute("SELECT COUNT(*) FROM messages WHERE thread_id=?", (i % 500,)).fetchone()
+            timings[label] = time.perf_counter() - t0
+            conn.close()
+        base = timings["ohne Tracing"]
+        for label, dt in timings.items():
+            print(f"{label:14} {2 * n:7d} Queries  {dt:7.3f} s  {1e6 * dt / (2 * n):7.1f} µs/Query  "
+                  f"(+{100 * (dt - base) / base:5.1f} %)")
+        print_table(METRICS.snapshot())
+
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="FINAURA Chat – SQL-Metriken")
+    ap.add_argument("--show", nargs="?", const=METRICS_PATH or "finaura_sql_metrics.json",
+                    help="Metrik-Datei als Tabelle ausgeben")
+    ap.add_argument("--bench", type=int, nargs="?", const=20_000, help="Tracing-Overhead messen (Anzahl Runden)")
+    ap.add_argument("--limit", type=int, default=25)
+    args = ap.parse_args()
+    if args.bench:
+        METRICS.path = None
+        _bench(args.bench)
+    else:
+        with open(args.show or METRICS_PATH or "finaura_sql_metrics.json", encoding="utf-8") as f:
+            data = json.load(f)
+        print(f"Slow-Schwelle {data['slow_ms']:.0f} ms, {len(data['queries'])} Queries")
+        print_table(data["queries"], args.limit)
@@ -7,7 +7,7 @@ show_version_in_sidebar(app_name="FINAURA IK Analyzer")
 #              Tabellenparser (pdfplumber) + Regex-Fallback, lokales Export-Verzeichnis
 #
 # Setup-Hinweise (bitte in Terminal ausführen):
-#   pip install streamlit altair pandas pdfplumber pymupdf pytesseract pillow xlsxwriter
+#   pip install streamlit altair pandas pdfplumber pypdf pymupdf pytesseract pillow xlsxwriter ocrmypdf
 #   streamlit run finaura_ik_analyzer_v1_1_0.py
 # =============================================================
 
@@ -24,6 +24,11 @@ import pandas as pd
 import streamlit as st
 import altair as alt
 
+from finaura_amounts import normalize_amounts
+from finaura_pdf_ingest_v1_2_0 import (
+    IngestedPdf, content_hash, get_ocr_cache, text_layer_flags, upload_pdfs_streamlit,
+)
+
 # Optionale Backends
 _BACKENDS = {
     "pdfplumber": None,
@@ -68,19 +73,22 @@ EINKOMMEN_HINTS = re.compile(r"(Einkommen|AHV-?Lohn|Brutto|massgebend(?:er)?\s+L
 TOTAL_HINTS     = re.compile(r"\bTotal\b|\bSumme\b|\bGesamt\b", re.IGNORECASE)
 JAHR_HINTS      = re.compile(r"(Beitragsjahr|Jahr)", re.IGNORECASE)
 
-def _norm_amount(s: str) -> Optional[float]:
-    s = s.strip().replace(" ", "").replace("’", "'")
-    s = re.sub(r"[\.'’]", "", s)   # entferne Tausender
-    s = s.replace(",", ".")         # Komma zu Punkt
-    m = re.search(r"-?\d+(?:\.\d+)?", s)
-    if not m:
-        return None
-    try:
-        return float(m.group(0))
-    except Exception:
-        return None
-
-def _ocr_page_with_fitz(page, zoom: float = 2.0) -> Optional[str]:
+def _max_abs_amounts(owners: List[int], raws: List[str]) -> Dict[int, float]:
+    """Normalisiert alle Betrags-Treffer in einem Durchgang und liefert je Zeile (owner) den betragsmässig grössten Wert."""
+    if not raws:
+        return {}
+    df = pd.DataFrame({"owner": owners, "val": normalize_amounts(raws)}).dropna()
+    if df.empty:
+        return {}
+    best = df.loc[df["val"].abs().groupby(df["owner"]).idxmax()]
+    return dict(zip(best["owner"].tolist(), best["val"].tolist()))
+
+def _ocr_page_with_fitz(page, zoom: float = 2.0, doc_sha: Optional[str] = None) -> Optional[str]:
+    cache = get_ocr_cache() if doc_sha else None
+    if cache is not None:
+        cached = cache.get_page_text(doc_sha, page.number, zoom)
+        if cached is not None:
+            return cached or None
     if _BACKENDS["pytesseract"] is None or _BACKENDS["PIL"] is None:
         return None
     try:
@@ -90,13 +98,22 @@ def _ocr_page_with_fitz(page, zoom: float = 2.0) -> Optional[str]:
         Image = _BACKENDS["PIL"]
         pytesseract = _BACKENDS["pytesseract"]
         img = Image.open(io.BytesIO(img_bytes))
-        text = pytesseract.image_to_string(img) or ""
-        return text.strip() or None
+        text = (pytesseract.image_to_string(img) or "").strip()
+        if cache is not None:
+            try:
+                cache.put_page_text(doc_sha, page.number, text, zoom)
+            except OSError:
+                pass
+        return text or None
     except Exception:
         return None
 
-def _extract_all_texts(file_bytes: bytes) -> Tuple[List[str], List[str]]:
-    """Liefert eine Liste von Seitentexten + Warnings (mit OCR-Fallback)."""
+def _extract_all_texts(file_bytes: bytes, layer: Optional[List[Optional[bool]]] = None,
+                       doc_sha: Optional[str] = None) -> Tuple[List[str], List[str]]:
+    """Liefert eine Liste von Seitentexten + Warnings (mit OCR-Fallback).
+
+    `layer`/`doc_sha` kommen aus dem Ingest (IngestedPdf) und ersparen Probe und Hash.
+    """
     warnings: List[str] = []
     pages: List[str] = []
 
@@ -126,21 +143,35 @@ def _extract_all_texts(file_bytes: bytes) -> Tuple[List[str], List[str]]:
         warnings.append("Keine Seiten erkannt.")
         return [], warnings
 
+    # Günstige Probe: Seiten ohne Textebene direkt zur OCR (keine pdfplumber-Analyse)
+    if layer is None:
+        layer = []
+        if fitz_doc is not None:
+            try:
+                layer = text_layer_flags(file_bytes)
+            except Exception:
+                layer = []
+    layer = list(layer) + [None] * (total_pages - len(layer))
+    if fitz_doc is None:
+        layer = [None] * total_pages  # ohne fitz keine OCR-Route
+
     for i in range(1, total_pages+1):
         txt = ""
-        if plumber_pdf is not None and i <= len(plumber_pdf.pages):
+        scanned = layer[i-1] is False
+        if not scanned and plumber_pdf is not None and i <= len(plumber_pdf.pages):
             try:
                 txt = plumber_pdf.pages[i-1].extract_text() or ""
             except Exception as e:
                 warnings.append(f"S{i} pdfplumber text: {e}")
             # Hinweis: Tabellenextraktion separat.
-        if not txt and fitz_doc is not None:
+        if not txt and fitz_doc is not None and not scanned:
             try:
                 txt = fitz_doc[i-1].get_text("text") or ""
             except Exception as e:
                 warnings.append(f"S{i} fitz text: {e}")
         if not txt and fitz_doc is not None:
-            ocr_txt = _ocr_page_with_fitz(fitz_doc[i-1], 2.0)
+            doc_sha = doc_sha or content_hash(file_bytes)
+            ocr_txt = _ocr_page_with_fitz(fitz_doc[i-1], 2.0, doc_sha)
             if ocr_txt:
                 txt = ocr_txt
             else:
@@ -191,7 +222,9 @@ def parse_tables_with_pdfplumber(file_bytes: bytes) -> List[Dict]:
 
 def parse_year_income_from_lines(lines: List[str]) -> List[Tuple[int, float]]:
     """Heuristik: Zeilen mit Jahr + Betrag. Bevorzugt Zeilen, die auch 'Einkommen/AHV-Lohn' o.ä. enthalten."""
-    records: List[Tuple[int,float]] = []
+    meta: List[Tuple[int, float]] = []   # (Jahr, Score) je Kandidatenzeile
+    owners: List[int] = []
+    raws: List[str] = []
     for ln in lines:
         y = YEAR_RE.search(ln)
         if not y:
@@ -200,25 +233,26 @@ def parse_year_income_from_lines(lines: List[str]) -> List[Tuple[int, float]]:
         amts = [a for a in amts if not YEAR_RE.fullmatch(a or "")]
         if not amts:
             continue
-        vals = [v for v in (_norm_amount(a) for a in amts) if v is not None]
-        if not vals:
-            continue
         score = 1.0
         if EINKOMMEN_HINTS.search(ln):
             score += 1.0
         if JAHR_HINTS.search(ln):
             score += 0.3
-        income = max(vals, key=abs) * score
-        records.append((int(y.group(1)), float(income)))
+        owners.extend([len(meta)] * len(amts))
+        raws.extend(amts)
+        meta.append((int(y.group(1)), score))
     agg: Dict[int, float] = {}
-    for y, inc in records:
-        agg[y] = agg.get(y, 0.0) + inc
+    for i, val in sorted(_max_abs_amounts(owners, raws).items()):
+        y, score = meta[i]
+        agg[y] = agg.get(y, 0.0) + float(val * score)
     return sorted([(y, v) for y, v in agg.items()], key=lambda x: x[0])
 
 def parse_year_income_from_tables(tables: List[Dict]) -> List[Tuple[int, float]]:
     """Heuristik über Tabellen: suche Zeilen, in denen ein Jahr + Betrag vorkommt."""
     rows = tables
-    candidates: List[Tuple[int, float]] = []
+    years: List[int] = []
+    owners: List[int] = []
+    raws: List[str] = []
     for row in rows:
         vals = row.get("values", [])
         if not vals or all((v or "").strip()=="" for v in vals):
@@ -230,30 +264,28 @@ def parse_year_income_from_tables(tables: List[Dict]) -> List[Tuple[int, float]]
                 y = int(m.group(1)); break
         if y is None:
             continue
-        amounts = []
-        for v in vals:
-            for a in AMT_RE.findall(str(v)):
-                if not YEAR_RE.fullmatch(a or ""):
-                    val = _norm_amount(a)
-                    if val is not None:
-                        amounts.append(val)
-        if not amounts:
+        amts = [a for v in vals for a in AMT_RE.findall(str(v)) if not YEAR_RE.fullmatch(a or "")]
+        if not amts:
             continue
-        income = max(amounts, key=abs)
-        candidates.append((y, float(income)))
+        owners.extend([len(years)] * len(amts))
+        raws.extend(amts)
+        years.append(y)
     agg: Dict[int, float] = {}
-    for y, inc in candidates:
-        agg[y] = agg.get(y, 0.0) + inc
+    for i, val in sorted(_max_abs_amounts(owners, raws).items()):
+        agg[years[i]] = agg.get(years[i], 0.0) + float(val)
     return sorted([(y, v) for y, v in agg.items()], key=lambda x: x[0])
 
-def aggregate_documents(file_objs: List[Tuple[str, bytes]]) -> Tuple[pd.DataFrame, pd.DataFrame, List[str]]:
+def aggregate_documents(docs: List[IngestedPdf]) -> Tuple[pd.DataFrame, pd.DataFrame, List[str]]:
     """Analysiert mehrere PDFs. Erkennt Person (AHV/Name), extrahiert Jahr/Einkommen, aggregiert."""
     warnings: List[str] = []
     rows = []
 
-    for fname, fbytes in file_objs:
-        page_texts, warns = _extract_all_texts(fbytes)
-        warnings.extend([f"{fname}: " + w for w in warns])
+    for doc in docs:
+        fname, fbytes = doc.name, doc.data
+        if doc.page_texts is None:
+            doc.page_texts, warns = _extract_all_texts(fbytes, doc.text_layer, doc.sha)
+            warnings.extend([f"{fname}: " + w for w in warns])
+        page_texts = doc.page_texts
         full_text = "\n".join(page_texts)
 
         keys = _extract_person_keys(full_text)
@@ -340,7 +372,7 @@ left, right = st.columns([1,1])
 
 with left:
     st.markdown("### 📤 Upload (mehrere PDFs)")
-    uploads = st.file_uploader("IK-Auszüge als PDF (Mehrfachauswahl möglich)", type=["pdf"], accept_multiple_files=True)
+    uploads = upload_pdfs_streamlit("IK-Auszüge als PDF (Mehrfachauswahl möglich)", key="ik_uploads")
     st.markdown("<div class='muted'>Tipp: Dateien der gleichen Person zusammen auswählen.</div>", unsafe_allow_html=True)
 
 with right:
@@ -348,9 +380,8 @@ with right:
     if not uploads:
         st.info("Bitte eine oder mehrere PDF-Dateien auswählen.")
     else:
-        file_objs = [ (u.name, u.read()) for u in uploads ]
         with st.spinner("Analysiere Dokumente…"):
-            df_year, df_total, warns = aggregate_documents(file_objs)
+            df_year, df_total, warns = aggregate_documents(uploads)
 
         for w in warns:
             st.warning(w)
@@ -1,7 +1,7 @@
 # FINAURA IK Analyzer — v1.2.2 (2025-10-18, Europe/Zurich)
 # CHANGE: Fix — `from __future__ import annotations` ganz oben platziert (Python-Anforderung).
 # Ablagepfad: ~/Downloads/finaura_app  (verknüpft mit  ~/Documents/Finaura/app)
-# Install:    pip install streamlit altair pandas pdfplumber pypdf
+# Install:    pip install streamlit altair pandas pdfplumber pypdf ocrmypdf
 # Run:        streamlit run finaura_ik_analyzer_v1_2_2.py
 #
 # Hinweis: Der Ordner ~/Downloads/finaura_app ist ein Symlink auf ~/Documents/Finaura/app.
@@ -19,6 +19,9 @@ import streamlit as st
 import pandas as pd
 import altair as alt
 
+from finaura_amounts import normalize_amounts
+from finaura_pdf_ingest_v1_2_0 import upload_pdfs_streamlit
+
 # ---------- Styles (Weiß/Blau) ----------
 PRIMARY = "#1e88e5"
 ACCENT = "#e3f2fd"
@@ -90,23 +93,16 @@ COMBINED = re.compile(
     re.IGNORECASE,
 )
 
-def _clean_amount(raw: str) -> t.Optional[float]:
-    if not raw:
-        return None
-    s = raw.strip()
-    s = s.replace("CHF", "").replace(".–", "").replace(".-", "").replace("’", "'")
-    s = s.replace(" ", "").replace("_", "").replace("\u00a0", "")
-    if "," in s and "." not in s:
-        s = s.replace(",", ".")
-    s = s.rstrip(".,-")
-    try:
-        return float(s)
-    except Exception:
-        import re as _re
-        try:
-            return float(int(_re.sub(r"\\D", "", s)))
-        except Exception:
-            return None
+def _clean_amounts(years: t.List[int], raws: t.List[str]) -> t.List[t.Tuple[int, float]]:
+    """Alle Treffer eines Dokuments in einem Durchgang normalisieren."""
+    if not raws:
+        return []
+    amounts = normalize_amounts(raws)
+    return [
+        (year, float(amount))
+        for year, amount in zip(years, amounts)
+        if not pd.isna(amount) and 1900 <= year <= 2100
+    ]
 
 @dataclass
 class ParseResult:
@@ -123,16 +119,15 @@ def parse_ik_text(file_name: str, text: str) -> ParseResult:
         res.msg = "Kein Text extrahierbar (evtl. Scan ohne OCR) — bitte PDF mit Text (kein Bild) verwenden."
         return res
 
-    candidates: t.List[t.Tuple[int, float]] = []
-
+    years: t.List[int] = []
+    raws: t.List[str] = []
     for m in COMBINED.finditer(text):
-        y, a = m.group("year"), m.group("amount")
-        year = int(y)
-        amount = _clean_amount(a)
-        if amount is not None and 1900 <= year <= 2100:
-            candidates.append((year, amount))
+        years.append(int(m.group("year")))
+        raws.append(m.group("amount"))
+    candidates = _clean_amounts(years, raws)
 
     if not candidates:
+        years, raws = [], []
         for line in text.splitlines():
             if re.search(LINES_HINT, line, flags=re.IGNORECASE):
                 y_m = None
@@ -144,10 +139,9 @@ def parse_ik_text(file_name: str, text: str) -> ParseResult:
                     a_m = re.search(apat, line)
                     if a_m: break
                 if y_m and a_m:
-                    year = int(y_m.group("year"))
-                    amount = _clean_amount(a_m.group("amount"))
-                    if amount is not None and 1900 <= year <= 2100:
-                        candidates.append((year, amount))
+                    years.append(int(y_m.group("year")))
+                    raws.append(a_m.group("amount"))
+        candidates = _clean_amounts(years, raws)
 
     if not candidates:
         res.msg = (
@@ -177,16 +171,17 @@ st.markdown('<div class="finaura-note">IK-PDFs derselben Person hochladen → Ja
 left, right = st.columns([1, 1])
 with left:
     st.subheader("📨 Upload (mehrere PDFs)")
-    files = st.file_uploader("IK-Auszüge als PDF (Mehrfachauswahl möglich)", type=["pdf"], accept_multiple_files=True)
+    files = upload_pdfs_streamlit("IK-Auszüge als PDF (Mehrfachauswahl möglich)", key="ik_uploads")
     debug = st.toggle("Debug-Modus (zeigt Textauszug & Treffer)", value=False)
-    st.caption("Tipp: Scans ohne sichtbaren Text (OCR) liefern keinen Inhalt.")
+    st.caption("Tipp: Gescannte Seiten werden beim Upload automatisch per OCR ergänzt.")
 
 results: t.List[ParseResult] = []
 all_items: t.List[t.Tuple[int, float, str]] = []
 
 if files:
     for f in files:
-        text = extract_text(f.read())
+        # Bytes kommen direkt aus dem Ingest (kein erneutes .read()), Seitentexte werden wiederverwendet
+        text = "\n".join(f.page_texts).strip() if f.page_texts is not None else extract_text(f.data)
         res = parse_ik_text(f.name, text)
         results.append(res)
         if res.ok:
@@ -6,15 +6,22 @@
 # Pfad-Empfehlung: ~/Documents/Finaura/app/
 # ------------------------------------------------------------
 # Setup (im Terminal ausführen, falls nötig):
-#   pip install streamlit altair pandas pdfplumber ocrmypdf
+#   pip install streamlit altair pandas pdfplumber pypdf ocrmypdf
 #   streamlit run finaura_pdf_ingest_v1_2_0.py
 # ============================================================
 
 from __future__ import annotations
 import io
 import os
+import re
+import hashlib
+import time
+import uuid
+import queue
 import tempfile
+import threading
 import subprocess
+from dataclasses import dataclass, field
 from typing import List
 
 def _maybe_show_version():
@@ -26,7 +33,11 @@ def _maybe_show_version():
 
 PDF_MAGIC = b"%PDF-"
 
+MAX_PAGES = int(os.getenv("FINAURA_MAX_PAGES", "300"))
+_STARTXREF_RE = re.compile(rb"startxref\s+(\d+)")
+
 def _is_pdf_file(upload) -> bool:
+    """Name/MIME-Prüfung ohne Dateizugriff (Header siehe check_pdf_structure)."""
     try:
         name = (upload.name or "").lower()
     except Exception:
@@ -36,56 +47,586 @@ def _is_pdf_file(upload) -> bool:
     mime = getattr(upload, "type", "") or getattr(upload, "mime", "")
     if mime and ("pdf" not in mime.lower()):
         return False
-    pos = upload.tell() if hasattr(upload, "tell") else None
+    return True
+
+def check_pdf_structure(data: bytes, max_pages: int = MAX_PAGES) -> str | None:
+    """Günstige Strukturprüfung vor jedem Parsing/OCR. Liefert Fehlertext oder None.
+
+    Prüft Header, %%EOF und startxref am Dateiende, Verschlüsselung und
+    (mit pypdf) die Seitenzahl über den Seitenbaum – ohne Seiteninhalte zu lesen.
+    """
+    if data[:5] != PDF_MAGIC:
+        return "kein PDF (Header fehlt)"
+    tail = data[-2048:]
+    if b"%%EOF" not in tail:
+        return "unvollständig (kein %%EOF am Dateiende)"
+    offsets = _STARTXREF_RE.findall(tail)
+    if not offsets or int(offsets[-1]) >= len(data):
+        return "beschädigt (startxref fehlt oder zeigt ins Leere)"
+    xref_at = int(offsets[-1])
+    encrypted = b"/Encrypt" in tail or b"/Encrypt" in data[xref_at:xref_at + 4096]
+    try:
+        from pypdf import PdfReader  # type: ignore
+    except ImportError:
+        return "verschlüsselt" if encrypted else None
+    try:
+        reader = PdfReader(io.BytesIO(data))
+        if reader.is_encrypted and not reader.decrypt(""):
+            return "passwortgeschützt"
+        n_pages = len(reader.pages)
+    except Exception as e:
+        return f"nicht lesbar ({str(e)[:80]})"
+    if n_pages == 0:
+        return "keine Seiten"
+    if n_pages > max_pages:
+        return f"zu viele Seiten ({n_pages} > {max_pages})"
+    return None
+
+# ---------- Text-Layer-Probe (ohne Layout-Analyse) ----------
+# Textoperatoren im Content-Stream: Tj, TJ, ' und " (jeweils nach einem String-Operanden)
+_TEXT_OP_RE = re.compile(rb"(?:\)|\]|>)\s*(?:Tj|TJ|'|\")|(?<![A-Za-z])T[jJ](?![A-Za-z])")
+
+def _pypdf_forms_have_text(res, depth: int = 0) -> bool:
+    # Text kann auch in Form-XObjects liegen (z. B. Formular-Vorlagen)
+    for xo in (res.get("/XObject") or {}).values():
+        xo = xo.get_object()
+        if xo.get("/Subtype") != "/Form":
+            continue
+        xres = xo.get("/Resources")
+        xres = xres.get_object() if xres is not None else {}
+        if xres.get("/Font") and _TEXT_OP_RE.search(xo.get_data() or b""):
+            return True
+        if depth < 3 and _pypdf_forms_have_text(xres, depth + 1):
+            return True
+    return False
+
+def _pypdf_page_has_text(page) -> bool:
+    res = page.get("/Resources")
+    res = res.get_object() if res is not None else None
+    if not res:
+        return False
+    if res.get("/Font"):
+        contents = page.get_contents()
+        if contents is not None and _TEXT_OP_RE.search(contents.get_data() or b""):
+            return True
+    return _pypdf_forms_have_text(res)
+
+def _fitz_page_has_text(page) -> bool:
+    fonts = page.get_fonts(full=True)
+    if not fonts:
+        return False
+    # referencer != 0 → Font gehört zu einem Form-XObject
+    if any(f[-1] for f in fonts):
+        return True
+    return bool(_TEXT_OP_RE.search(page.read_contents() or b""))
+
+def text_layer_flags(pdf_bytes: bytes) -> List[bool]:
+    """Pro Seite: hat sie eine Textebene?
+
+    Prüft nur Font-Ressourcen und Textoperatoren im Content-Stream (pypdf,
+    sonst PyMuPDF) – keine Textextraktion, keine Layout-Analyse.
+    """
     try:
-        upload.seek(0)
-        header = upload.read(5)
-        return header == PDF_MAGIC
-    finally:
+        from pypdf import PdfReader  # type: ignore
+        pages = PdfReader(io.BytesIO(pdf_bytes)).pages
+        check = _pypdf_page_has_text
+    except ImportError:
         try:
-            if pos is not None:
-                upload.seek(pos)
+            import fitz  # type: ignore
+        except ImportError:
+            return _plumber_text_flags(pdf_bytes)
+        pages = fitz.open(stream=pdf_bytes, filetype="pdf")
+        check = _fitz_page_has_text
+    flags: List[bool] = []
+    for page in pages:
+        try:
+            flags.append(check(page))
         except Exception:
-            pass
+            flags.append(False)
+    return flags
 
-def _has_text(pdf_fileobj) -> bool:
+def _plumber_text_flags(pdf_bytes: bytes) -> List[bool]:
+    # Langsamer Fallback, falls weder pypdf noch PyMuPDF installiert ist
     try:
         import pdfplumber
     except Exception as e:
         raise RuntimeError("pdfplumber nicht installiert. Bitte 'pip install pdfplumber' ausführen.") from e
-    pdf_fileobj.seek(0)
-    with pdfplumber.open(pdf_fileobj) as pdf:
-        for page in pdf.pages:
-            if (page.extract_text() or "").strip():
-                return True
-    return False
+    with pdfplumber.open(io.BytesIO(pdf_bytes)) as pdf:
+        return [bool((page.extract_text() or "").strip()) for page in pdf.pages]
+
+def _plan_ocr(flags: List[bool]) -> tuple[bool, List[int] | None]:
+    """(OCR nötig?, Seitenauswahl) – None = ganzes Dokument (reiner Scan)."""
+    missing = [i for i, has in enumerate(flags) if not has]
+    if not missing:
+        return False, None
+    return True, (missing if len(missing) < len(flags) else None)
+
+def _page_ranges(pages: List[int]) -> str:
+    """[0, 1, 2, 5] -> '1-3,6' (1-basiert, Format von ocrmypdf --pages)"""
+    out: List[str] = []
+    for p in sorted(set(pages)):
+        if out and out[-1][1] == p - 1:
+            out[-1] = (out[-1][0], p)
+        else:
+            out.append((p, p))
+    return ",".join(f"{a + 1}" if a == b else f"{a + 1}-{b + 1}" for a, b in out)
+
+# ---------- Übergabe an die Analyzer ----------
+@dataclass
+class IngestedPdf:
+    """Ergebnis des Ingest: Bytes + alles, was der Ingest schon über das PDF weiss.
+
+    Downstream-Parser lesen `data`/`view` statt die Upload-Datei erneut zu lesen
+    und übernehmen `text_layer` statt neu zu proben. `page_texts` wird vom ersten
+    Parser befüllt, der Seitentexte extrahiert, und von weiteren wiederverwendet.
+    """
+    name: str
+    data: bytes = field(repr=False)
+    sha: str = ""
+    page_count: int = 0
+    text_layer: List[bool] = field(default_factory=list)
+    ocr_pages: List[int] = field(default_factory=list)
+    page_texts: List[str] | None = field(default=None, repr=False)
+
+    @property
+    def view(self) -> memoryview:
+        return memoryview(self.data)
+
+    @property
+    def size(self) -> int:
+        return len(self.data)
+
+    def open(self) -> io.BytesIO:
+        # BytesIO teilt sich den Puffer mit `data`, solange nicht geschrieben wird
+        return io.BytesIO(self.data)
+
+def _read_upload(upload) -> bytes:
+    if hasattr(upload, "getvalue"):  # BytesIO/UploadedFile: ohne Kopie
+        return upload.getvalue()
+    upload.seek(0)
+    data = upload.read()
+    upload.seek(0)
+    return data
+
+def _ingested(name: str, data: bytes, flags: List[bool], ocr_pages: List[int] | None = None,
+              sha: str = "") -> IngestedPdf:
+    ocr = list(range(len(flags))) if ocr_pages is None else list(ocr_pages)
+    done = set(ocr)
+    layer = [True if i in done else f for i, f in enumerate(flags)]
+    return IngestedPdf(name=name, data=data, sha=sha or content_hash(data), page_count=len(flags),
+                       text_layer=layer, ocr_pages=ocr)
+
+# ---------- OCR-Cache (persistent, nach Inhalts-Hash) ----------
+_SINGLETON_LOCK = threading.RLock()  # schützt die prozessweiten Instanzen (Cache, Queue)
+OCR_CACHE_DIR = os.getenv("FINAURA_OCR_CACHE_DIR", os.path.expanduser("~/Documents/Finaura/cache/ocr"))
+OCR_CACHE_MB = float(os.getenv("FINAURA_OCR_CACHE_MB", "512"))
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+class OcrCache:
+    """Datei-Cache für OCR-Ergebnisse: SHA-256 der Eingabe → OCR-PDF bzw. Seitentext.
+
+    - Byte-Budget mit LRU-Verdrängung (Zugriffszeit = mtime, wird bei Treffern erneuert)
+    - Atomare Writes: temporäre Datei + fsync + os.replace – nach einem Absturz
+      gibt es nur vollständige Einträge oder gar keinen (Reste *.tmp werden beim Start gelöscht)
+    """
+
+    def __init__(self, root: str = OCR_CACHE_DIR, max_bytes: int = int(OCR_CACHE_MB * 1024 * 1024)):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self._sizes: dict[str, int] = {}
+        for entry in os.scandir(root):
+            if entry.name.endswith(".tmp"):
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+            elif entry.is_file():
+                self._sizes[entry.name] = entry.stat().st_size
+        self._total = sum(self._sizes.values())
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.root, name)
+
+    def get(self, name: str) -> bytes | None:
+        path = self._path(name)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)  # LRU: zuletzt benutzt
+            return data
+        except OSError:
+            return None
+
+    def put(self, name: str, data: bytes) -> None:
+        if len(data) > self.max_bytes:
+            return
+        fd, tmp = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self._path(name))
+        except Exception:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+        with self._lock:
+            self._total += len(data) - self._sizes.get(name, 0)
+            self._sizes[name] = len(data)
+            if self._total > self.max_bytes:
+                self._evict()
+
+    def _evict(self) -> None:
+        # Älteste Einträge zuerst löschen, bis das Budget wieder eingehalten ist
+        def _mtime(n: str) -> float:
+            try:
+                return os.stat(self._path(n)).st_mtime
+            except OSError:
+                return 0.0
+        for name in sorted(self._sizes, key=_mtime):
+            if self._total <= self.max_bytes:
+                break
+            try:
+                os.remove(self._path(name))
+            except OSError:
+                pass
+            self._total -= self._sizes.pop(name)
+
+    def get_pdf(self, sha: str) -> bytes | None:
+        return self.get(f"{sha}.pdf")
+
+    def put_pdf(self, sha: str, data: bytes) -> None:
+        self.put(f"{sha}.pdf", data)
+
+    def get_page_text(self, sha: str, page: int, zoom: float = 2.0) -> str | None:
+        data = self.get(f"{sha}.p{page}.z{zoom:g}.txt")
+        return data.decode("utf-8") if data is not None else None
+
+    def put_page_text(self, sha: str, page: int, text: str, zoom: float = 2.0) -> None:
+        self.put(f"{sha}.p{page}.z{zoom:g}.txt", text.encode("utf-8"))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._sizes), "bytes": self._total, "max_bytes": self.max_bytes}
+
+_OCR_CACHE: OcrCache | None = None
+
+def get_ocr_cache() -> OcrCache | None:
+    """Prozessweiter Cache; None, falls das Verzeichnis nicht anlegbar ist (Cache wird dann übersprungen)."""
+    global _OCR_CACHE
+    with _SINGLETON_LOCK:
+        if _OCR_CACHE is None:
+            try:
+                _OCR_CACHE = OcrCache()
+            except OSError:
+                return None
+        return _OCR_CACHE
+
+# ---------- OCR-Jobqueue (nicht blockierend) ----------
+# --skip-text lässt Seiten mit Textebene unangetastet (--force-ocr würde alles neu rastern)
+OCR_CMD = ["ocrmypdf", "--deskew", "--skip-text"]
+OCR_MAX_WORKERS = int(os.getenv("FINAURA_OCR_WORKERS", "2"))
+OCR_MAX_PENDING = int(os.getenv("FINAURA_OCR_MAX_PENDING", "32"))
+OCR_TIMEOUT_S = float(os.getenv("FINAURA_OCR_TIMEOUT_S", "600"))
+OCR_RESULT_TTL_S = 3600  # nicht abgeholte Ergebnisse (Session geschlossen) danach verwerfen
+
+JOB_QUEUED, JOB_RUNNING, JOB_DONE = "queued", "running", "done"
+JOB_FAILED, JOB_CANCELLED, JOB_TIMEOUT = "failed", "cancelled", "timeout"
+_JOB_FINAL = {JOB_DONE, JOB_FAILED, JOB_CANCELLED, JOB_TIMEOUT}
+
+@dataclass
+class OcrJob:
+    id: str
+    name: str
+    pages: List[int] | None = None  # nur diese Seiten OCR'en (None = ganzes Dokument)
+    sha: str = ""
+    status: str = JOB_QUEUED
+    error: str = ""
+    submitted_at: float = field(default_factory=time.monotonic)
+    started_at: float | None = None
+    finished_at: float | None = None
+    _src: bytes = field(default=b"", repr=False)
+    _out: bytes | None = field(default=None, repr=False)
+    _cancel: threading.Event = field(default_factory=threading.Event, repr=False)
+    _done: threading.Event = field(default_factory=threading.Event, repr=False)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in _JOB_FINAL
+
+    @property
+    def elapsed(self) -> float:
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+class OcrJobQueue:
+    """Lokale Jobqueue: begrenzter Worker-Pool für ocrmypdf mit Status, Abbruch und Timeout."""
+
+    def __init__(self, max_workers: int = OCR_MAX_WORKERS, max_pending: int = OCR_MAX_PENDING,
+                 timeout_s: float = OCR_TIMEOUT_S, cache: OcrCache | None = None):
+        self.timeout_s = timeout_s
+        self.cache = cache
+        self.max_pending = max_pending
+        self._jobs: dict[str, OcrJob] = {}
+        self._lock = threading.Lock()
+        self._queue: queue.Queue[str] = queue.Queue()
+        self._workers = [
+            threading.Thread(target=self._worker, name=f"finaura-ocr-{i}", daemon=True)
+            for i in range(max(1, max_workers))
+        ]
+        for w in self._workers:
+            w.start()
+
+    def submit(self, name: str, pdf_bytes: bytes, pages: List[int] | None = None, sha: str = "") -> str:
+        with self._lock:
+            now = time.monotonic()
+            for jid in [j.id for j in self._jobs.values()
+                        if j.finished and now - (j.finished_at or now) > OCR_RESULT_TTL_S]:
+                del self._jobs[jid]
+            pending = sum(1 for j in self._jobs.values() if not j.finished)
+            if pending >= self.max_pending:
+                raise RuntimeError(f"OCR-Warteschlange voll ({pending} Jobs). Bitte später erneut versuchen.")
+            job = OcrJob(id=uuid.uuid4().hex[:12], name=name, pages=pages,
+                         sha=sha or content_hash(pdf_bytes), _src=bytes(pdf_bytes))
+            self._jobs[job.id] = job
+        self._queue.put(job.id)
+        return job.id
+
+    def get(self, job_id: str) -> OcrJob | None:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> bool:
+        job = self.get(job_id)
+        if job is None or job.finished:
+            return False
+        job._cancel.set()
+        with self._lock:
+            # Prüfen und Beenden unter derselben Sperre wie der Start im Worker
+            queued = job.status == JOB_QUEUED and self._mark(job, JOB_CANCELLED)
+        if queued:
+            job._done.set()
+        return True
+
+    def wait(self, job_id: str, timeout: float | None = None) -> OcrJob:
+        job = self.get(job_id)
+        if job is None:
+            raise KeyError(job_id)
+        job._done.wait(timeout)
+        return job
+
+    def result(self, job_id: str) -> io.BytesIO:
+        """OCR-Ergebnis abholen; der Job wird danach aus der Queue entfernt."""
+        job = self.get(job_id)
+        if job is None:
+            raise KeyError(job_id)
+        if job.status != JOB_DONE:
+            raise RuntimeError(job.error or f"OCR-Job {job.status}")
+        with self._lock:
+            self._jobs.pop(job_id, None)
+        return io.BytesIO(job._out or b"")
+
+    def discard(self, job_id: str) -> None:
+        self.cancel(job_id)
+        with self._lock:
+            self._jobs.pop(job_id, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts: dict[str, int] = {}
+            for j in self._jobs.values():
+                counts[j.status] = counts.get(j.status, 0) + 1
+        return counts
+
+    @staticmethod
+    def _mark(job: OcrJob, status: str, error: str = "", out: bytes | None = None) -> bool:
+        # Nur unter self._lock aufrufen
+        if job.finished:
+            return False
+        job.status, job.error, job._out = status, error, out
+        job.finished_at = time.monotonic()
+        job._src = b""
+        return True
+
+    def _finish(self, job: OcrJob, status: str, error: str = "", out: bytes | None = None) -> None:
+        with self._lock:
+            if not self._mark(job, status, error, out):
+                return
+        job._done.set()
+
+    def _worker(self) -> None:
+        while True:
+            job = self.get(self._queue.get())
+            if job is None:
+                continue
+            with self._lock:
+                # Abbruch zwischen Queue und Start? Dann nicht mehr starten
+                if job.finished or job._cancel.is_set():
+                    continue
+                job.status, job.started_at = JOB_RUNNING, time.monotonic()
+            try:
+                self._run(job)
+            except Exception as e:  # Worker darf nie sterben
+                self._finish(job, JOB_FAILED, str(e))
+
+    def _run(self, job: OcrJob) -> None:
+        with tempfile.TemporaryDirectory() as td:
+            src = os.path.join(td, "in.pdf")
+            dst = os.path.join(td, "out.pdf")
+            cmd = list(OCR_CMD)
+            src_bytes, splice = job._src, None
+            if job.pages:
+                try:
+                    src_bytes = _select_pages(job._src, job.pages)
+                    splice = job.pages
+                except ImportError:
+                    cmd += ["--pages", _page_ranges(job.pages)]  # ocrmypdf >= 13
+            with open(src, "wb") as f:
+                f.write(src_bytes)
+            try:
+                proc = subprocess.Popen(cmd + [src, dst], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            except FileNotFoundError:
+                self._finish(job, JOB_FAILED, "ocrmypdf nicht gefunden. Installiere es mit 'pip install ocrmypdf' und 'brew install tesseract'.")
+                return
+            deadline = time.monotonic() + self.timeout_s
+            while True:
+                try:
+                    _, err = proc.communicate(timeout=0.25)
+                    break
+                except subprocess.TimeoutExpired:
+                    if job._cancel.is_set() or time.monotonic() > deadline:
+                        proc.kill()
+                        proc.communicate()
+                        if job._cancel.is_set():
+                            self._finish(job, JOB_CANCELLED)
+                        else:
+                            self._finish(job, JOB_TIMEOUT, f"OCR-Timeout nach {self.timeout_s:.0f} s.")
+                        return
+            if proc.returncode != 0:
+                self._finish(job, JOB_FAILED, f"OCR fehlgeschlagen: {err.decode('utf-8', 'ignore')[:400]}")
+                return
+            with open(dst, "rb") as f:
+                out = f.read()
+            if splice is not None:
+                out = _splice_pages(job._src, out, splice)
+            if self.cache is not None:
+                try:
+                    self.cache.put_pdf(job.sha, out)
+                except OSError:
+                    pass
+            self._finish(job, JOB_DONE, out=out)
+
+def _select_pages(pdf_bytes: bytes, pages: List[int]) -> bytes:
+    """Nur die angegebenen Seiten als eigenes PDF (Eingabe für ocrmypdf)."""
+    from pypdf import PdfReader, PdfWriter  # type: ignore
+    reader = PdfReader(io.BytesIO(pdf_bytes))
+    writer = PdfWriter()
+    for i in pages:
+        writer.add_page(reader.pages[i])
+    buf = io.BytesIO()
+    writer.write(buf)
+    return buf.getvalue()
+
+def _splice_pages(orig_bytes: bytes, ocr_bytes: bytes, pages: List[int]) -> bytes:
+    """OCR-Seiten an ihre ursprüngliche Position zurücksetzen, Textseiten unverändert lassen."""
+    from pypdf import PdfReader, PdfWriter  # type: ignore
+    orig = PdfReader(io.BytesIO(orig_bytes))
+    ocr = PdfReader(io.BytesIO(ocr_bytes))
+    replaced = {p: ocr.pages[k] for k, p in enumerate(pages)}
+    writer = PdfWriter()
+    for i, page in enumerate(orig.pages):
+        writer.add_page(replaced.get(i, page))
+    if orig.metadata:
+        writer.add_metadata(orig.metadata)
+    buf = io.BytesIO()
+    writer.write(buf)
+    return buf.getvalue()
+
+_OCR_QUEUE: OcrJobQueue | None = None
+
+def get_ocr_queue() -> OcrJobQueue:
+    """Prozessweite Queue (von allen Streamlit-Sessions geteilt)."""
+    global _OCR_QUEUE
+    with _SINGLETON_LOCK:
+        if _OCR_QUEUE is None:
+            _OCR_QUEUE = OcrJobQueue(cache=get_ocr_cache())
+        return _OCR_QUEUE
+
+def ingest_pdf(name: str, data: bytes) -> IngestedPdf:
+    """Blockierende Variante (für Skripte): OCR bei Bedarf, Ergebnis als IngestedPdf."""
+    flags = text_layer_flags(data)
+    needed, pages = _plan_ocr(flags)
+    sha = content_hash(data)
+    if not needed:
+        return _ingested(name, data, flags, ocr_pages=[], sha=sha)
+    cache = get_ocr_cache()
+    cached = cache.get_pdf(sha) if cache is not None else None
+    if cached is None:
+        q = get_ocr_queue()
+        try:
+            job_id = q.submit(name, data, pages=pages, sha=sha)
+            q.wait(job_id)
+            cached = q.result(job_id).getvalue()
+        except RuntimeError:
+            # ocrmypdf fehlt/scheitert: Original weitergeben, der Analyzer OCR't seitenweise
+            return _ingested(name, data, flags, ocr_pages=[], sha=sha)
+    return _ingested(name, cached, flags, ocr_pages=pages, sha=sha)
 
 def ensure_ocr(uploaded_file):
-    uploaded_file.seek(0)
-    if _has_text(uploaded_file):
+    """Kompatibilität: liefert einen Bytes-Stream (OCR'd falls nötig)."""
+    doc = ingest_pdf(getattr(uploaded_file, "name", "upload.pdf"), _read_upload(uploaded_file))
+    if not doc.ocr_pages:
         uploaded_file.seek(0)
         return uploaded_file
-    uploaded_file.seek(0)
-    with tempfile.TemporaryDirectory() as td:
-        src = os.path.join(td, "in.pdf")
-        dst = os.path.join(td, "out.pdf")
-        with open(src, "wb") as f:
-            f.write(uploaded_file.read())
-        try:
-            subprocess.run(
-                ["ocrmypdf", "--deskew", "--skip-text", "--force-ocr", src, dst],
-                check=True,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE
-            )
-        except FileNotFoundError as e:
-            raise RuntimeError("ocrmypdf nicht gefunden. Installiere es mit 'pip install ocrmypdf' und 'brew install tesseract'.") from e
-        except subprocess.CalledProcessError as e:
-            raise RuntimeError(f"OCR fehlgeschlagen: {e.stderr.decode('utf-8', 'ignore')[:400]}") from e
-        return open(dst, "rb")
+    return doc.open()
+
+_STATUS_LABEL = {
+    JOB_QUEUED: "⏳ wartet", JOB_RUNNING: "🔄 OCR läuft", JOB_DONE: "✅ fertig",
+    JOB_FAILED: "❌ fehlgeschlagen", JOB_CANCELLED: "🚫 abgebrochen", JOB_TIMEOUT: "⌛ Timeout",
+}
+
+def validate_uploads(uploads, max_total_mb: int = 500,
+                     max_pages: int = MAX_PAGES) -> tuple[list, List[str]]:
+    """Prüft Datei für Datei (in Upload-Reihenfolge) und verwirft früh.
+
+    Liefert ([(upload, bytes), …], [Fehlermeldungen]). Die Grössenprüfung nutzt
+    `.size` und läuft vor dem Lesen der Bytes; sobald das Budget erschöpft ist,
+    werden weitere Dateien ohne Zugriff auf den Inhalt abgelehnt.
+    """
+    budget = max_total_mb * 1024 * 1024
+    used = 0
+    accepted, errors = [], []
+    for up in uploads:
+        name = getattr(up, "name", "Datei")
+        if not _is_pdf_file(up):
+            errors.append(f"{name}: kein PDF (Name/Typ)")
+            continue
+        size = getattr(up, "size", None)
+        if size is not None and used + int(size) > budget:
+            errors.append(f"{name}: Upload-Budget überschritten ({(used + int(size)) / 1048576:.1f} MB > {max_total_mb} MB)")
+            continue
+        data = _read_upload(up)
+        if used + len(data) > budget:
+            errors.append(f"{name}: Upload-Budget überschritten ({(used + len(data)) / 1048576:.1f} MB > {max_total_mb} MB)")
+            continue
+        problem = check_pdf_structure(data, max_pages)
+        if problem:
+            errors.append(f"{name}: {problem}")
+            continue
+        used += len(data)
+        accepted.append((up, data))
+    return accepted, errors
 
 def upload_pdfs_streamlit(label: str = "📥 Upload (nur PDF)", key: str = "pdf_ingest",
-                          max_total_mb: int = 500):
+                          max_total_mb: int = 500, poll_s: float = 1.0, max_pages: int = MAX_PAGES):
     import streamlit as st
     _maybe_show_version()
     uploads = st.file_uploader(
@@ -94,28 +635,75 @@ def upload_pdfs_streamlit(label: str = "📥 Upload (nur PDF)", key: str = "pdf_
     )
     if not uploads:
         return []
-    valid, invalid = [], []
-    total_bytes = 0
-    for up in uploads:
-        if _is_pdf_file(up):
-            size = getattr(up, "size", None) or 0
-            total_bytes += int(size)
-            valid.append(up)
-        else:
-            invalid.append(up.name)
-    if invalid:
-        st.error("❌ Nicht-PDF erkannt und verworfen: " + ", ".join(invalid))
-    total_mb = total_bytes / (1024 * 1024)
-    if total_mb > max_total_mb:
-        st.error(f"❌ Upload zu groß: {total_mb:.1f} MB > erlaubt {max_total_mb} MB.")
+    valid, errors = validate_uploads(uploads, max_total_mb, max_pages)
+    if errors:
+        st.error("❌ Verworfen:\n" + "\n".join(f"- {e}" for e in errors))
+    if not valid:
+        st.warning("⚠️ Keine verwendbaren PDFs erkannt.")
         return []
-    result = []
-    for up in valid:
+    q = get_ocr_queue()
+    cache = q.cache
+    # sha256 -> Zustand je Upload-Inhalt {state, flags, pages, job_id, data, error}. Bleibt über
+    # Reruns erhalten (abgebrochen = ignorieren, fehlgeschlagen = Original, fertig = Ergebnis),
+    # bis die Datei den Uploader verlässt
+    docs: dict = st.session_state.setdefault(f"{key}_ocr_jobs", {})
+    shas = [content_hash(data) for _, data in valid]  # gleicher Name/gleiche Grösse ≠ gleicher Inhalt
+    for gone in set(docs) - set(shas):
+        old = docs.pop(gone)
+        if old.get("job_id") and old["state"] not in _JOB_FINAL:
+            q.discard(old["job_id"])
+    result: List[IngestedPdf] = []
+    pending = []
+    for (up, data), sha in zip(valid, shas):
+        name = getattr(up, "name", "Datei")
+        doc = docs.get(sha)
         try:
-            fixed = ensure_ocr(up)
-            result.append(fixed)
+            if doc is None:
+                flags = text_layer_flags(data)
+                needed, pages = _plan_ocr(flags)
+                cached = cache.get_pdf(sha) if needed and cache is not None else None
+                if not needed or cached is not None:
+                    doc = docs[sha] = {"state": JOB_DONE, "flags": flags, "pages": pages if needed else [],
+                                       "data": cached}
+                else:
+                    doc = docs[sha] = {"state": JOB_QUEUED, "flags": flags, "pages": pages}
+                    doc["job_id"] = q.submit(name, data, pages=pages, sha=sha)
+            if doc["state"] not in _JOB_FINAL:
+                job = q.get(doc["job_id"])
+                status = job.status if job is not None else JOB_FAILED  # einmal lesen, Worker läuft weiter
+                if job is None:
+                    doc.update(state=JOB_FAILED, error="OCR-Job nicht mehr vorhanden")
+                elif status == JOB_DONE:
+                    doc.update(state=JOB_DONE, data=q.result(job.id).getvalue())
+                elif status in _JOB_FINAL:
+                    doc.update(state=status, error=job.error or _STATUS_LABEL[status])
+                    q.discard(job.id)
+                else:
+                    pending.append(job)
+                    continue
         except Exception as e:
-            st.error(f"❌ OCR-Problem bei '{getattr(up, 'name', 'Datei')}': {e}")
+            doc = docs[sha] = {"state": JOB_FAILED, "flags": doc["flags"] if doc else [], "pages": [],
+                               "error": str(e)}  # flags=[] → Analyzer probt selbst
+        if doc["state"] == JOB_DONE:
+            result.append(_ingested(name, doc.get("data") or data, doc["flags"], ocr_pages=doc["pages"], sha=sha))
+        elif doc["state"] == JOB_CANCELLED:
+            st.warning(f"🚫 '{name}': OCR abgebrochen, Datei wird ignoriert.")
+        else:
+            # Ohne OCR-Ergebnis trotzdem weitergeben: Seiten ohne Textebene bleiben in
+            # `text_layer` False, der Analyzer OCR't sie dann selbst (fitz + pytesseract)
+            st.warning(f"⚠️ OCR-Problem bei '{name}': {doc['error']} – Seiten werden im Analyzer einzeln erkannt.")
+            result.append(_ingested(name, data, doc["flags"], ocr_pages=[], sha=sha))
+    if pending:
+        done = len(valid) - len(pending)
+        st.progress(done / len(valid), text=f"OCR: {done}/{len(valid)} PDF(s) bereit")
+        for job in pending:
+            c1, c2 = st.columns([4, 1])
+            scope = f"Seiten {_page_ranges(job.pages)}" if job.pages else "alle Seiten"
+            c1.caption(f"{job.name} ({scope}): {_STATUS_LABEL[job.status]} ({job.elapsed:.0f} s)")
+            if c2.button("Abbrechen", key=f"{key}_cancel_{job.id}"):
+                q.cancel(job.id)
+        time.sleep(poll_s)
+        st.experimental_rerun()
     if result:
         st.success(f"✅ {len(result)} PDF(s) akzeptiert und vorbereitet.")
     else:
@@ -131,8 +719,9 @@ def _demo():
     files = upload_pdfs_streamlit()
     if files:
         st.subheader("Vorbereitete PDFs")
-        for i, f in enumerate(files, 1):
-            st.write(f"• PDF #{i} — bereit (Bytes-Stream)")
+        for i, doc in enumerate(files, 1):
+            ocr = f", OCR: Seiten {_page_ranges(doc.ocr_pages)}" if doc.ocr_pages else ""
+            st.write(f"• PDF #{i} — {doc.name}: {doc.page_count} Seite(n){ocr} — bereit")
 
 if __name__ == "__main__":
     _demo()